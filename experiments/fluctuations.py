@@ -1,167 +1,147 @@
-from neuron import h, gui 
-from neuron.units import ms, mV
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import matplotlib.cm as cm
-from cells_def import Cell
-
 import os
+import sys
 
-# Get the directory where this script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+
+from neuron import h
+import numpy as np
+import pandas as pd
+from morphology_cache import file_hash
+from parallel import run_jobs
+from protocols import build_noise_network, build_noise_network_batch, noise_trial, noise_trial_batch, unstack_results
+from result_cache import ResultCache, cell_spec
+import importlib.util
 
 
 # --- Load Cell and Mechanisms ---
-h.load_file("stdrun.hoc")
-h.load_file("import3d.hoc")
-
-# Create pyramidal cell and add active channels
-pyr = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
-pyr.add_sodium_channels()
-pyr.add_potassium_channels()
-pyr.add_ih_channels()
-
-# --- Simulation Settings ---
-h.v_init = -90
-h.dt = 0.05
-h.tstop = 600  # simulate 600 ms total
-h.celsius = 34
-
-# --- Function to apply noise to soma ---
-def add_noise_to_soma(seed):
-    gfluct = h.Gfluct2(pyr.soma(0.5)) # refer to the Gfluct .mod file for publication details
-    gfluct.delay = 100           # start noise at 100 ms
-    gfluct.inhib = 1
-    gfluct.g_e0 = 0.006 * 2.1 # adjust to achieve desired spiking rate (note: original publication suggests that e/i ratio remains constant)
-    gfluct.std_e = 0.0019 * 2.1
-    gfluct.g_i0 = 0.044
-    gfluct.std_i = 0.0069
-    gfluct.E_i = -80
-    gfluct.tau_e = 7.8
-    gfluct.tau_i = 8.8
-    gfluct.new_seed(seed)
-    return gfluct
-
-# Add synaptic input - can be commented out if not needed
-# Load Chandelier Cell
-
-chc = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
-chc.add_sodium_channels()
-chc.add_potassium_channels()
-chc.add_ih_channels()
-
-from synapse_general import connect_boutons, default_syn_weight # change synapse file as needed
-
-# Connect ChC boutons to Pyr soma at specific locations
-synapses = connect_boutons(chc, pyr)
-for syn in synapses:
-    syn.syn.e = -70 # Setting the reversal potential
-
-e_rev = syn.syn.e
-print(f"ChC synaptic reversal potential: {e_rev} mV")
-
-stim_chc = h.IClamp(chc.soma(0.5))
-stim_chc.delay = 90  # ms
-stim_chc.dur = 510   # ms
-stim_chc.amp = 0.3   # nA
-
-v_pyr_chc = h.Vector().record(chc.soma(0.5)._ref_v)
-
-
-# --- Storage ---
-spike_results = []
-all_spike_times = []
-first_spike_times = []
+# The pyramidal cell is built first, then the Chandelier Cell whose boutons are connected to it (ChC input can be
+# left out by removing "chc" here). Each worker process builds this network once and then runs trials on it.
+morphologies = {
+    "pyr": os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"),
+    "chc": os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"),
+}
+synapse_module = "synapse_general"  # change synapse file as needed
+syn_e = -70.0  # ChC synaptic reversal potential (mV)
+stim_chc = {"delay": 90, "dur": 510, "amp": 0.3}  # ms, ms, nA
+n_workers = os.cpu_count()
+backend = None  # "serial", "pool" or "mpi"; by default MPI when started with mpiexec -n N, else a process pool
+batch_size = 1  # > 1: simulate this many trials together in one run, on copies of the network (see below)
+
+# --- Simulation Settings and noise applied to the soma ---
+noise_params = {
+    "delay": 100,           # start noise at 100 ms
+    "inhib": 1,
+    "g_e0": 0.006 * 2.1,    # adjust to achieve desired spiking rate (note: original publication suggests that e/i ratio remains constant)
+    "std_e": 0.0019 * 2.1,
+    "g_i0": 0.044,
+    "std_i": 0.0069,
+    "E_i": -80,
+    "tau_e": 7.8,
+    "tau_i": 8.8,
+}
 
 # --- Run Trials ---
 n_trials = 10
 noise_duration_ms = 500  # from 100 to 600 ms
 
-for trial in range(n_trials):
-    gfluct = add_noise_to_soma(seed=3000 + trial)
-
-    t_vec = h.Vector().record(h._ref_t)
-    v_vec = h.Vector().record(pyr.soma(0.5)._ref_v)
-
-    apc = h.APCount(pyr.soma(0.5))
-    apc.thresh = -20
-
-    h.finitialize(h.v_init)
-    h.run()
-
-    t = np.array(t_vec)
-    v = np.array(v_vec)
-
-    # Spike detection
-    crossings = np.where((v[:-1] < -20) & (v[1:] >= -20))[0]
-    spike_times = t[crossings]
-    all_spike_times.append(spike_times)
-
-    isis = np.diff(spike_times) if len(spike_times) > 1 else []
-
-    # Vm after noise onset
-    v_mask = t > 100
-    vm_mean = np.mean(v[v_mask])
-    vm_std = np.std(v[v_mask])
-
-    # Frequency
-    spike_count = np.sum((spike_times >= 100) & (spike_times <= 1100))
-    freq = spike_count / (noise_duration_ms / 1000)
-
-    if len(spike_times) > 0:
-        first_spike_times.append(spike_times[0])
-
-    spike_results.append({
-        "trial": trial + 1,
-        "spike_times": spike_times,
-        "spike_count": spike_count,
-        "isi": isis,
-        "vm_mean": vm_mean,
-        "vm_std": vm_std,
-        "frequency_hz": freq
-    })
-
-# Raster Plot - uncomment if needed to visualize spikes
-# plt.figure(figsize=(12, 8))
-# trial_spacing = 1.5
-# y_positions = [trial_spacing * i for i in range(n_trials)][::-1]
-
-# for i, spikes in enumerate(all_spike_times):
-#     y = y_positions[i]
-#     plt.vlines(spikes, y, y + 1.2, color='black', linewidth=3.0)
-
-# # Dashed horizontal lines between trials
-# for y in y_positions:
-#     plt.hlines(y, 0, 1100, color='gray', linestyle='--', linewidth=0., alpha=0.5)
-
-# yticks = [y + 0.6 for y in y_positions]
-# yticklabels = [f"Trial {i+1}" for i in range(n_trials)]
-# plt.yticks(yticks, yticklabels)
-# plt.xlabel("Time (ms)")
-# plt.ylabel("Trial")
-# plt.title("Raster plot of soma spikes under noise")
-# plt.xlim(0, 600)
-# plt.tight_layout()
-# plt.show()
-
-# Summary Table
-df = pd.DataFrame([{
-    "Trial": res["trial"],
-    "Spike Count": res["spike_count"],
-    "Frequency (Hz)": res["frequency_hz"],
-    "Vm Mean (mV)": res["vm_mean"],
-    "Vm Std (mV)": res["vm_std"],
-    "Spike Times (ms)": ", ".join([f"{st:.2f}" for st in res["spike_times"]])
-} for res in spike_results])
-
-
-print("\nSummary Table:")
-print(df.to_string(index=False))
-# --- Save Summary Table to Excel ---
-filename = os.path.join(script_dir, f"spike_summary_dend40again.xlsx")
-df.to_excel(filename, index=False)
-print(f"\nSaved summary table to '{filename}'")
-
-
-
+protocol = {
+    "protocol": "fluctuations",
+    "v_init": -90,
+    "dt": 0.05,
+    "tstop": 600,  # simulate 600 ms total
+    "celsius": 34,
+    "noise": noise_params,
+    "thresh": -20,  # spike detection threshold
+    "count_until": 1100,  # spikes are counted from noise onset until this time
+    "noise_duration": noise_duration_ms,
+    "record": "full",  # "spikes": NetCon spike times and Vm sampled every sample_dt ms, for long or many trials
+    "sample_dt": 0.5,
+    "settle": 80,  # ms: trials start from a stored settled state at this time (before the ChC step and the noise)
+}
+
+if __name__ == "__main__":
+    print(f"ChC synaptic reversal potential: {syn_e} mV")
+
+    if batch_size == 1:
+        # Every trial has its own seed and is independent of the others, so the trials give the same results however
+        # they are spread over the workers
+        jobs = [{**protocol, "seed": 3000 + trial} for trial in range(n_trials)]
+        setup, job_fn = build_noise_network, noise_trial
+    else:
+        # Trials batched in one run share Gfluct2's random stream, seeded with the seed of the first trial of the
+        # batch (see protocols.noise_trial_batch): reproducible, but not the same trials as with batch_size = 1
+        jobs = [{**protocol, "seed": 3000 + trial, "batch_size": min(batch_size, n_trials - trial)}
+                for trial in range(0, n_trials, batch_size)]
+        setup, job_fn = build_noise_network_batch, noise_trial_batch
+
+    # Everything besides the cells and the job that the trials depend on, for the result cache
+    network = {
+        "synapses": file_hash(importlib.util.find_spec(synapse_module).origin), "syn_e": syn_e,
+        "stim_chc": stim_chc if "chc" in morphologies else None,
+    }
+    cells = [cell_spec(cell_name, path) for cell_name, path in morphologies.items()]
+    cache = ResultCache()
+    keys = [cache.key(cells, {**job, **network}) for job in jobs]
+    results = cache.cached_batch(keys, lambda missing: run_jobs(
+        setup, job_fn, [jobs[i] for i in missing], backend, n_workers,
+        setup_args=(morphologies, synapse_module, syn_e, stim_chc) + ((batch_size,) if batch_size > 1 else ())))
+    if batch_size > 1:
+        results = [trial for stacked in results for trial in unstack_results(stacked)]
+
+    # --- Storage ---
+    spike_results = []
+    all_spike_times = []
+    first_spike_times = []
+
+    for trial, result in enumerate(results):
+        spike_times = result["spike_times"]
+        all_spike_times.append(spike_times)
+
+        if len(spike_times) > 0:
+            first_spike_times.append(spike_times[0])
+
+        spike_results.append({"trial": trial + 1, **result})
+
+    # Raster Plot - uncomment if needed to visualize spikes
+    # plt = pyplot()  # from interactive import pyplot
+    # plt.figure(figsize=(12, 8))
+    # trial_spacing = 1.5
+    # y_positions = [trial_spacing * i for i in range(n_trials)][::-1]
+
+    # for i, spikes in enumerate(all_spike_times):
+    #     y = y_positions[i]
+    #     plt.vlines(spikes, y, y + 1.2, color='black', linewidth=3.0)
+
+    # # Dashed horizontal lines between trials
+    # for y in y_positions:
+    #     plt.hlines(y, 0, 1100, color='gray', linestyle='--', linewidth=0., alpha=0.5)
+
+    # yticks = [y + 0.6 for y in y_positions]
+    # yticklabels = [f"Trial {i+1}" for i in range(n_trials)]
+    # plt.yticks(yticks, yticklabels)
+    # plt.xlabel("Time (ms)")
+    # plt.ylabel("Trial")
+    # plt.title("Raster plot of soma spikes under noise")
+    # plt.xlim(0, 600)
+    # plt.tight_layout()
+    # plt.show()
+
+    # Summary Table
+    df = pd.DataFrame([{
+        "Trial": res["trial"],
+        "Spike Count": res["spike_count"],
+        "Frequency (Hz)": res["frequency_hz"],
+        "Vm Mean (mV)": res["vm_mean"],
+        "Vm Std (mV)": res["vm_std"],
+        "Spike Times (ms)": ", ".join([f"{st:.2f}" for st in res["spike_times"]])
+    } for res in spike_results])
+
+
+    print("\nSummary Table:")
+    print(df.to_string(index=False))
+    # --- Save Summary Table to Excel ---
+    filename = os.path.join(script_dir, f"spike_summary_dend40again.xlsx")
+    df.to_excel(filename, index=False)
+    print(f"\nSaved summary table to '{filename}'")
@@ -1,14 +1,21 @@
-from neuron import h, gui
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+
+from neuron import h
 from neuron.units import ms, mV
 from cells_def import Cell
-import os
+import interactive
 
 # Load NEURON mechanisms and morphology
 h.load_file("stdrun.hoc")
 h.load_file("import3d.hoc")
 
 # Create cells
-pyramidal_cell = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
+pyramidal_cell = Cell(os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"), "pyr")
 
 # Add channels
 pyramidal_cell.add_sodium_channels()
@@ -37,7 +44,7 @@ v_pyr_soma = h.Vector().record(pyramidal_cell.soma(0.5)._ref_v)
 # Add synaptic input - can be commented out if not needed
 # --- Load Chandelier Cell ---
 
-chandelier_cell = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
+chandelier_cell = Cell(os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"), "chc")
 chandelier_cell.add_sodium_channels()
 chandelier_cell.add_potassium_channels()
 chandelier_cell.add_ih_channels()
@@ -62,29 +69,34 @@ h.tstop = 700
 h.dt = 0.05
 h.celsius = 34
 
-# --- Plot GUI Graphs ---
+# Graphs are only built in interactive mode (see model/interactive.py)
+graphs = []
+if interactive.gui():
+    # --- Plot GUI Graphs ---
 
-graph1 = h.Graph()
-graph1.size(0, h.tstop, -120, 40)
-graph1.addvar("Pyr Soma", pyramidal_cell.soma(0.5)._ref_v, 3, 1)
-h.graphList[0].append(graph1)
+    graph1 = h.Graph()
+    graph1.size(0, h.tstop, -120, 40)
+    graph1.addvar("Pyr Soma", pyramidal_cell.soma(0.5)._ref_v, 3, 1)
+    h.graphList[0].append(graph1)
+    graphs.append(graph1)
 
-# # can also be commented out if ChC activation is not necessary
-# graph2 = h.Graph()
-# graph2.size(0, h.tstop, -120,40)
-# graph2.addvar("ChC Soma", chandelier_cell.soma(0.5)._ref_v, 3, 1)
-# h.graphList[0].append(graph2)
+    # # can also be commented out if ChC activation is not necessary
+    # graph2 = h.Graph()
+    # graph2.size(0, h.tstop, -120,40)
+    # graph2.addvar("ChC Soma", chandelier_cell.soma(0.5)._ref_v, 3, 1)
+    # h.graphList[0].append(graph2)
 
-# --- Plot Gfluct2 conductances in NEURON GUI ---
-graph_ge = h.Graph()
-graph_ge.size(0, h.tstop, 0, 0.1)  # Set y-axis range appropriately
-graph_ge.addvar("g_e", pyr_fluct._ref_g_e, 2, 1)
-# graph_ge.addvar("g_i", pyr_fluct._ref_g_i, 4, 1)
-h.graphList[0].append(graph_ge)
+    # --- Plot Gfluct2 conductances in NEURON GUI ---
+    graph_ge = h.Graph()
+    graph_ge.size(0, h.tstop, 0, 0.1)  # Set y-axis range appropriately
+    graph_ge.addvar("g_e", pyr_fluct._ref_g_e, 2, 1)
+    # graph_ge.addvar("g_i", pyr_fluct._ref_g_i, 4, 1)
+    h.graphList[0].append(graph_ge)
 
 
 # Run simulation
 h.finitialize(h.v_init)
 h.run()
-graph1.flush()
+for graph in graphs:
+    graph.flush()
 # graph2.flush()
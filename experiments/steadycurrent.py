@@ -1,6 +1,14 @@
-from neuron import h, gui
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+
+from neuron import h
 from neuron.units import ms, mV
 from cells_def import Cell
+import interactive
 import numpy as np
 from synapse_general import connect_boutons, default_syn_weight
 
@@ -8,8 +16,8 @@ from synapse_general import connect_boutons, default_syn_weight
 h.load_file("stdrun.hoc")
 
 # Create the Chandelier (ChC) and Pyramidal (Pyr) cells
-chc_cell = Cell("C:/Users/user/Documents/NIN_internship/L23ChC-j140718b_ar_boutons.asc", "chc")
-pyr_cell = Cell("C:/Users/user/Documents/NIN_internship/L23pyr-j150802c_ar.asc", "pyr")
+chc_cell = Cell(os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"), "chc")
+pyr_cell = Cell(os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"), "pyr")
 
 # Add channels to both cells
 chc_cell.add_ih_channels()
@@ -47,6 +55,8 @@ active_synapses = connect_boutons(chc_cell, pyr_cell)
 # Global state for bouton toggling
 all_active = False  # Start with inhibition OFF
 gaba_reversal = h.ref(-70.0)
+chc_amp = h.ref(0.3)
+pyr_amp = h.ref(0.4) # 0.3 for subthreshold stimulation, 0.45 for 50Hz spiking
 
 def update_current():
     """Update stimulation amplitudes and run simulation."""
@@ -58,8 +68,8 @@ def update_current():
     h.v_init = -90 * mV
     h.finitialize(h.v_init)
     h.run()
-    graph1.flush()
-    graph2.flush()
+    for graph in graphs:
+        graph.flush()
 
 # Function to toggle all boutons at once
 def activate_all_boutons():
@@ -72,63 +82,69 @@ def activate_all_boutons():
     print(f"{state} all boutons")
     update_current()
 
-# -------------------------------
-# GUI Panel for Current Injection
-# -------------------------------
-h.xpanel("Interactive VI Curve")
-h.xlabel("Adjust Current Injection (nA)")
-chc_amp = h.ref(0.3)
-pyr_amp = h.ref(0.4) # 0.3 for subthreshold stimulation, 0.45 for 50Hz spiking
-h.xvalue("ChC Current", chc_amp, 0.1, update_current)
-h.xvalue("Pyr Current", pyr_amp, 0.1, update_current)
-h.xpanel()
-
-# -------------------------------
-
-# GUI Panel for Bouton Adjustment
-# -------------------------------
-h.xpanel("Bouton Adjustment")
-h.xlabel("Activate boutons on/off:")
-# Button to toggle all simultaneously
-h.xbutton("Enable inhibition", activate_all_boutons)
-h.xvalue("GABA Reversal (mV)", gaba_reversal, 10, update_current)
-h.xpanel()
-
-# -------------------------------
-# Graphs for Voltage Recording
-# -------------------------------
-graph1 = h.Graph()
-graph1.size(0, h.tstop, -120, 40)
-graph1.addvar("ChC Soma", chc_cell.soma(0.5)._ref_v, 2, 1)
-h.graphList[0].append(graph1)
-
-graph2 = h.Graph()
-graph2.size(0, h.tstop, -120, 40)
-graph2.addvar("Pyr Soma", pyr_cell.soma(0.5)._ref_v, 3, 1)
-h.graphList[0].append(graph2)
-
-graph3 = h.Graph()
-graph3.size(0, h.tstop, -120, 40)
-graph3.addvar("ChC Bouton 1", chc_cell.axon[104](0.5)._ref_v, 4, 1)
-graph3.addvar("ChC Bouton 2", chc_cell.axon[106](0.5)._ref_v, 5, 1)
-graph3.addvar("ChC Bouton 3", chc_cell.axon[108](0.5)._ref_v, 6, 1)
-h.graphList[0].append(graph3)
-
-graph4 = h.Graph()
-graph4.size(0, h.tstop, -120, 40)
-graph4.addvar("Pyr AIS", pyr_cell.axon[0](0.5)._ref_v, 10, 1)
-h.graphList[0].append(graph4)
-
-# Graphs for Current Injection
-graph5 = h.Graph()
-graph5.size(0, h.tstop, -0.5, 1)
-graph5.addvar("ChC Current", stim_chc._ref_i, 3, 1)
-h.graphList[0].append(graph5)
-
-graph6 = h.Graph()
-graph6.size(0, h.tstop, -0.5, 1)
-graph6.addvar("Pyr Current", stim_pyr._ref_i, 4, 1)
-h.graphList[0].append(graph6)
+# Graphs and panels are only built in interactive mode (see model/interactive.py)
+graphs = []
+if interactive.gui():
+    # -------------------------------
+    # GUI Panel for Current Injection
+    # -------------------------------
+    h.xpanel("Interactive VI Curve")
+    h.xlabel("Adjust Current Injection (nA)")
+    h.xvalue("ChC Current", chc_amp, 0.1, update_current)
+    h.xvalue("Pyr Current", pyr_amp, 0.1, update_current)
+    h.xpanel()
+
+    # -------------------------------
+
+    # GUI Panel for Bouton Adjustment
+    # -------------------------------
+    h.xpanel("Bouton Adjustment")
+    h.xlabel("Activate boutons on/off:")
+    # Button to toggle all simultaneously
+    h.xbutton("Enable inhibition", activate_all_boutons)
+    h.xvalue("GABA Reversal (mV)", gaba_reversal, 10, update_current)
+    h.xpanel()
+
+    # -------------------------------
+    # Graphs for Voltage Recording
+    # -------------------------------
+    graph1 = h.Graph()
+    graph1.size(0, h.tstop, -120, 40)
+    graph1.addvar("ChC Soma", chc_cell.soma(0.5)._ref_v, 2, 1)
+    h.graphList[0].append(graph1)
+    graphs.append(graph1)
+
+    graph2 = h.Graph()
+    graph2.size(0, h.tstop, -120, 40)
+    graph2.addvar("Pyr Soma", pyr_cell.soma(0.5)._ref_v, 3, 1)
+    h.graphList[0].append(graph2)
+    graphs.append(graph2)
+
+    graph3 = h.Graph()
+    graph3.size(0, h.tstop, -120, 40)
+    for k, bouton in enumerate(chc_cell.cartridges()[2][:3]):  # the first boutons of the connected cartridge
+        graph3.addvar(f"ChC Bouton {k + 1}", bouton(0.5)._ref_v, 4 + k, 1)
+    h.graphList[0].append(graph3)
+    graphs.append(graph3)
+
+    graph4 = h.Graph()
+    graph4.size(0, h.tstop, -120, 40)
+    graph4.addvar("Pyr AIS", pyr_cell.axon[0](0.5)._ref_v, 10, 1)
+    h.graphList[0].append(graph4)
+    graphs.append(graph4)
+
+    # Graphs for Current Injection
+    graph5 = h.Graph()
+    graph5.size(0, h.tstop, -0.5, 1)
+    graph5.addvar("ChC Current", stim_chc._ref_i, 3, 1)
+    h.graphList[0].append(graph5)
+    graphs.append(graph5)
+
+    graph6 = h.Graph()
+    graph6.size(0, h.tstop, -0.5, 1)
+    graph6.addvar("Pyr Current", stim_pyr._ref_i, 4, 1)
+    h.graphList[0].append(graph6)
+    graphs.append(graph6)
 
 
 # -------------------------------
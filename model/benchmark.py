@@ -0,0 +1,144 @@
+""" Benchmarks of building the cells and of running each protocol, for tools/benchmark_suite.py.
+
+A benchmark case returns rows of {case, phase, wall_s, sim_ms, sim_ms_per_s, nseg, states, peak_rss_mb}:
+
+- 'build:<cell>' times the phases of building a cell: the morphology import with Import3d and from the morphology
+  cache, discretize(), add_passive_properties(), the three add_*_channels() passes and h.finitialize().
+- 'protocol:<name>' builds the model of a protocol from a protocol file (see protocol_runner) and runs its first
+  job at a fixed dt, without a settled state, and reports the simulated ms per wall-clock second.
+
+Peak RSS is the peak of the whole process, so every case should run in a fresh process (tools/benchmark_suite.py does). """
+
+import gc
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from neuron import h
+
+import discretization
+import protocol_runner
+from cells_def import Cell
+
+build_phases = ("load_morphology", "discretize", "add_passive_properties", "add_ih_channels", "add_sodium_channels",
+                "add_potassium_channels")
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (NaN if it cannot be measured)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except (ImportError, AttributeError):
+            return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, kB on Linux
+
+
+@contextmanager
+def timed_methods(cls, names, times):
+    """Add the wall time of every call of the methods cls.<name> to times[name] while in the context."""
+    originals = {name: cls.__dict__[name] for name in names}
+
+    def timed(name, method):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[name] = times.get(name, 0) + time.perf_counter() - start
+        return wrapper
+
+    for name, method in originals.items():
+        setattr(cls, name, timed(name, method))
+    try:
+        yield times
+    finally:
+        for name, method in originals.items():
+            setattr(cls, name, method)
+
+
+def _row(case, phase, wall_s, sim_ms=None, **extra):
+    return {"case": case, "phase": phase, "wall_s": wall_s, "sim_ms": sim_ms,
+            "sim_ms_per_s": sim_ms / wall_s if sim_ms and wall_s > 0 else None, **extra}
+
+
+def benchmark_build(cell_name, morphology_path, v_init=-90, celsius=34, dt=0.025):
+    """Rows for 'build:<cell_name>': the morphology is first imported with Import3d (into an empty morphology cache),
+    then the cell is built again from the cache, timing each phase of the second build."""
+    case = f"build:{cell_name}"
+    rows = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        times = {}
+        with timed_methods(Cell, ["load_morphology"], times):
+            cell = Cell(morphology_path, cell_name, cache_dir=cache_dir)
+        rows.append(_row(case, "morphology_import3d", times["load_morphology"]))
+        del cell
+        gc.collect()
+
+        times = {}
+        start = time.perf_counter()
+        with timed_methods(Cell, build_phases, times):
+            cell = Cell(morphology_path, cell_name, cache_dir=cache_dir)
+            cell.add_ih_channels()
+            cell.add_sodium_channels()
+            cell.add_potassium_channels()
+        total = time.perf_counter() - start
+    rows.append(_row(case, "morphology_cached", times.pop("load_morphology")))
+    rows += [_row(case, phase, wall) for phase, wall in times.items()]
+
+    h.dt = dt
+    h.celsius = celsius
+    start = time.perf_counter()
+    h.finitialize(v_init)
+    rows.append(_row(case, "finitialize", time.perf_counter() - start))
+
+    nseg = sum(sec.nseg for sec in cell.all)
+    rows.append(_row(case, "total", total + rows[-1]["wall_s"], nseg=nseg, states=discretization.count_states(cell),
+                     peak_rss_mb=peak_rss_mb()))
+    return rows
+
+
+def benchmark_protocol(spec, morphologies, defaults, dt=0.025):
+    """Rows for 'protocol:<name>': build the protocol's model, then run its first job at dt with settle = 0."""
+    protocol = protocol_runner.Protocol(spec, morphologies, defaults)
+    case = f"protocol:{protocol.name}"
+    job = {**protocol.jobs()[0], "dt": dt, "settle": 0}
+
+    start = time.perf_counter()
+    state = protocol.setup(*protocol.setup_args())
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = protocol.job_fn(state, job)
+    run = time.perf_counter() - start
+
+    # A current search runs several times, each until its answer is known; its simulated time is not known here
+    sim_ms = job["tstop"] if "runs" not in result else None
+    nseg = sum(sec.nseg for sec in h.allsec())
+    return [
+        _row(case, "build", build),
+        _row(case, "run", run, sim_ms, dt=h.dt),
+        _row(case, "total", build + run, nseg=nseg, peak_rss_mb=peak_rss_mb()),
+    ]
+
+
+def cases(config):
+    """All benchmark case names for a loaded protocol file."""
+    return ([f"build:{cell_name}" for cell_name in config["morphologies"]] +
+            [f"protocol:{spec.get('name', spec['type'])}" for spec in config["protocols"]])
+
+
+def run_case(case, config, dt=0.025):
+    """Rows of one benchmark case (see cases())."""
+    kind, name = case.split(":", 1)
+    if kind == "build":
+        return benchmark_build(name, protocol_runner.resolve_path(config["morphologies"][name]), dt=dt)
+    if kind == "protocol":
+        spec = next(spec for spec in config["protocols"] if spec.get("name", spec["type"]) == name)
+        return benchmark_protocol(spec, config["morphologies"], config.get("defaults", {}), dt)
+    raise ValueError(f"Unknown benchmark case '{case}'")
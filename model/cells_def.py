@@ -1,8 +1,7 @@
 import os
-from neuron import h, gui, load_mechanisms
-from neuron.units import mV, ms
-import matplotlib.pyplot as plt
-import tkinter as tk
+from neuron import h
+import discretization
+import morphology_cache
 
 h.load_file("stdrun.hoc")
 h.load_file("import3d.hoc")
@@ -54,6 +53,21 @@ kv7_ais_pyr = 150 #specific for ais
 
 kv1_axon_pyr = 300
 
+# Boutons: short axon sections of the ChC with a swelling (as in the '_boutons' ChC reconstruction)
+bouton_min_diam = 0.8  # µm, largest 3D diameter of a bouton section
+bouton_max_length = 20  # µm
+
+# Approximate memory per item, for Cell.complexity(): a node per segment (voltage, matrix entries, area, ...), a record
+# per mechanism instance besides its doubles (a range variable each, and a derivative per STATE), a record per section
+# and its 3D points
+node_bytes = 160
+mechanism_instance_bytes = 64
+section_bytes = 400
+pt3d_bytes = 32
+
+# Regions used for channel insertion, in the order they are indexed
+regions = ('soma', 'dend', 'apic', 'hillock', 'ais', 'axon', 'boutons')
+
 h('vShift_naischc = 12')
 h('vShift_inact_naischc = 16')
 h('vShift_nachc = 16')
@@ -64,10 +78,17 @@ h('vShift_inact_naispyr = 20')
 h('vShift_napyr = 10')
 h('vShift_inact_napyr = 20')
 
+# hoc globals set above, part of the model definition (e.g. for result_cache.model_fingerprint)
+vshift_names = ('vShift_naischc', 'vShift_inact_naischc', 'vShift_nachc', 'vShift_inact_nachc',
+                'vShift_naispyr', 'vShift_inact_naispyr', 'vShift_napyr', 'vShift_inact_napyr')
+
 class Cell:
-    def __init__(self, morphology_path, cell_name):
+    def __init__(self, morphology_path, cell_name, use_cache=True, cache_dir=None, discretization=None):
         self.morphology_path = morphology_path
         self.cell_name = cell_name
+        self.discretization = discretization  # see discretization.py; None is the reference mesh
+        self.use_cache = use_cache  # reuse the parsed section tree from a previous run (see morphology_cache.py)
+        self.cache_dir = cache_dir
         self.all = h.SectionList()
         self.soma = None
         self.section_types = {}
@@ -80,22 +101,50 @@ class Cell:
         return f"{self.cell_name}"
 
     def load_morphology(self):
-        cell = h.Import3d_Neurolucida3()
-        cell.input(self.morphology_path)
-        i3d = h.Import3d_GUI(cell, 0)
-        i3d.instantiate(self)
+        data = None
+        if self.use_cache:
+            cache_file = morphology_cache.cache_path(self.morphology_path, self.cache_dir)
+            data = morphology_cache.load(cache_file)
+
+        if data is not None:
+            morphology_cache.build_sections(self, data)  # warm start: skip Import3d entirely
+        else:
+            cell = h.Import3d_Neurolucida3()
+            cell.input(self.morphology_path)
+            i3d = h.Import3d_GUI(cell, 0)
+            i3d.instantiate(self)
+            data = morphology_cache.snapshot_sections(self.all)
+            if self.use_cache:
+                try:
+                    morphology_cache.save(cache_file, data)
+                except OSError as e:
+                    print(f"  Warning: could not write morphology cache {cache_file}: {e}")
+        self.morphology = data  # section tree as loaded, before any later change of L (used by snapshot())
 
         print(f"Loading morphology for {self.cell_name}:")
+        self.index_sections()
+
+    def index_sections(self, verbose=True):
+        self.section_names = {}  # section -> custom name (the inverse of self.sections)
+        self.regions = {region: [] for region in regions}  # region -> sections, see region_of_section()
+        self.region_of = {}  # section -> region
+        self._cartridges = None  # see cartridges()
         for sec in self.all:  # Use self.all instead of h.allsec()
             sec_name = sec.name().split('.')[-1]
             custom_name = f"{self.cell_name}.{sec_name}"
             
             # Store the section with its custom name
             self.sections[custom_name] = sec
+            self.section_names[sec] = custom_name
+
+            region = self.region_of_section(sec, sec_name)
+            self.regions.setdefault(region, []).append(sec)
+            self.region_of[sec] = region
             
             if 'soma' in sec_name.lower():
                 self.soma = sec
-                print(f"  Soma found: {custom_name}")
+                if verbose:
+                    print(f"  Soma found: {custom_name}")
             
             sec_type = sec_name.split('[')[0]
             if sec_type not in self.section_types:
@@ -113,28 +162,75 @@ class Cell:
         # print(f"Total sections loaded for {self.cell_name}: {len(self.all)}")
         # print(f"Section types: {', '.join(self.section_types.keys())}")
 
-
-    def discretize(self):
+    def region_of_section(self, sec, sec_name):
+        """Region of a section: soma, dend, apic, hillock (ChC axon[0], same properties as soma), ais,
+        axon (axon excluding AIS) or boutons (ChC only)."""
+        sec_type = sec_name.split('[')[0]
+        if 'soma' in sec_type:
+            return 'soma'
+        if 'dend' in sec_type:
+            return 'dend'
+        if 'apic' in sec_type:
+            return 'apic'
+        if 'axon' in sec_type:
+            if self.cell_name == "pyr" and sec_name.endswith('[0]'):  # AIS of pyramidal cell
+                return 'ais'
+            if self.cell_name == "chc" and sec_name.endswith('[0]'):
+                return 'hillock'
+            if self.cell_name == "chc" and sec_name.endswith('[1]'):  # AIS of chandelier cell
+                return 'ais'
+            if self.cell_name == "chc":  # only the ChC reconstruction has boutons
+                max_diam = max((sec.diam3d(i) for i in range(sec.n3d())), default=0)
+                if sec.L <= bouton_max_length and max_diam >= bouton_min_diam:
+                    return 'boutons'
+            return 'axon'
+        return sec_type
+
+    def cartridges(self):
+        """Boutons grouped by cartridge. A cartridge is an unbranched stretch of axon ending in a terminal, with one
+        or more boutons on it (e.g. chc axon[103] to axon[115], with boutons axon[104], axon[106], ..., axon[114]).
+        Returns a list of cartridges in the order of the section tree, each a list of its bouton sections from base
+        to tip. Boutons at branch points belong to no cartridge. Found from the topology once per cell."""
+        if self._cartridges is None:
+            self._cartridges = []
+            bases = set()
+            for bouton in self.regions.get('boutons', []):
+                base = bouton
+                while True:  # up to the branch point
+                    parent = base.parentseg()
+                    if (parent is None or len(parent.sec.children()) != 1
+                            or self.region_of[parent.sec] not in ('axon', 'boutons')):
+                        break
+                    base = parent.sec
+                if base in bases:
+                    continue
+                bases.add(base)
+                cartridge, sec = [], base
+                while True:  # down to the terminal
+                    if self.region_of[sec] == 'boutons':
+                        cartridge.append(sec)
+                    children = sec.children()
+                    if len(children) != 1:
+                        break
+                    sec = children[0]
+                if not children:
+                    self._cartridges.append(cartridge)
+        return self._cartridges
+
+    def insert_mechanism(self, region_names, mech, **params):
+        """Insert a mechanism in all sections of the given regions and set its parameters, e.g. gbar=1200."""
+        for region in region_names:
+            for sec in self.regions.get(region, []):
+                sec.insert(mech)
+                for param, value in params.items():
+                    setattr(sec, f"{param}_{mech}", value)
+
+    def discretize(self, policy=None):
+        """Set nseg of every section from a discretization policy: a preset name ('reference', 'fast',
+        'ultra_fast'), a discretization.DiscretizationPolicy, or None for the policy given to the constructor."""
+        self.discretization = discretization.get_policy(policy if policy is not None else self.discretization)
         for sec in self.all:
-            if self.cell_name == "chc" and sec.name().endswith("axon[1]"):
-                sec.nseg = int((sec.L/1) + 0.999)  # 1 segment per ~1 µm
-                if sec.nseg % 2 == 0:
-                    sec.nseg += 1  # Make sure nseg is odd
-            elif self.cell_name == "pyr" and (sec.name().endswith("axon[0]") or sec.name().endswith("dend[12]")):
-                sec.nseg = int((sec.L/1) + 0.999)
-                if sec.nseg % 2 == 0:
-                    sec.nseg += 1        
-            elif "axon" in sec.name():
-                sec.nseg = int((sec.L/10) + 0.999)  # 1 segment per ~10 µm
-                if sec.nseg % 2 == 0:
-                    sec.nseg += 1  # Make sure nseg is odd
-            else:
-                d_lambda = 0.1
-                min_seg = 3
-                nseg_calc = int((sec.L / (d_lambda * h.lambda_f(3000)) + 0.999) / 2) * 2 + 1
-                sec.nseg = max(nseg_calc, min_seg)
-
-
+            sec.nseg = self.discretization.nseg(self, sec)
 
     def add_passive_properties(self):
         if self.cell_name == "chc":
@@ -176,92 +272,57 @@ class Cell:
 
 
     def add_sodium_channels(self):
-        for custom_name, sec in self.sections.items():
-            sec_type = custom_name.split('.')[-1].split('[')[0]
-            suffix_sd =  f"na{self.cell_name}" # Suffixes used for sodium channels in soma and dendrites 
-            suffix_ais = f"nais{self.cell_name}" # Suffixes used for sodium channels in AIS
-            suffix_axon = f"nax{self.cell_name}" # Suffixes used for sodium channels in axon
+        suffix_sd =  f"na{self.cell_name}" # Suffixes used for sodium channels in soma and dendrites 
+        suffix_ais = f"nais{self.cell_name}" # Suffixes used for sodium channels in AIS
+        suffix_axon = f"nax{self.cell_name}" # Suffixes used for sodium channels in axon
 
-            # Determine densities based on cell type
-            if self.cell_name == "chc":
-                na_soma, na_dend, na_ais, na_axon = na_soma_chc, na_dend_chc, na_ais_chc, na_axon_chc
-            elif self.cell_name == "pyr":
-                na_soma, na_dend, na_ais, na_axon = na_soma_pyr, na_dend_pyr, na_ais_pyr, na_axon_pyr
-
-            # Sodium channel insertion
-            if 'soma' in sec_type:
-                sec.insert(suffix_sd)
-                setattr(sec, f'gbar_{suffix_sd}', na_soma)
-            elif 'dend' in sec_type or 'apic' in sec_type:  # Dendrites and apical dendrites
-                sec.insert(suffix_sd)
-                setattr(sec, f'gbar_{suffix_sd}', na_dend)
-            elif 'axon' in sec_type:
-                if self.cell_name == "pyr" and custom_name.endswith('[0]'):  # AIS of pyramidal cell
-                    sec.L = 25
-                    sec.insert(suffix_ais)
-                    setattr(sec, f'gbar_{suffix_ais}', na_ais)
-                elif self.cell_name == "chc" and custom_name.endswith('[0]'):  # same properties as soma
-                    sec.L = 1
-                    sec.insert(suffix_sd)
-                    setattr(sec, f'gbar_{suffix_sd}', na_soma)
-                elif self.cell_name == "chc" and custom_name.endswith('[1]'):  # AIS of chandelier cell
-                    sec.insert(suffix_ais)
-                    setattr(sec, f'gbar_{suffix_ais}', na_ais)
-                else:  # Axon excluding AIS
-                    sec.insert(suffix_axon)
-                    setattr(sec, f'gbar_{suffix_axon}', na_axon)
+        # Determine densities based on cell type
+        if self.cell_name == "chc":
+            na_soma, na_dend, na_ais, na_axon = na_soma_chc, na_dend_chc, na_ais_chc, na_axon_chc
+            for sec in self.regions['hillock']:
+                sec.L = 1
+        elif self.cell_name == "pyr":
+            na_soma, na_dend, na_ais, na_axon = na_soma_pyr, na_dend_pyr, na_ais_pyr, na_axon_pyr
+            for sec in self.regions['ais']:
+                sec.L = 25
+
+        # Sodium channel insertion
+        self.insert_mechanism(['soma'], suffix_sd, gbar=na_soma)
+        self.insert_mechanism(['dend', 'apic'], suffix_sd, gbar=na_dend)  # Dendrites and apical dendrites
+        self.insert_mechanism(['hillock'], suffix_sd, gbar=na_soma)  # same properties as soma
+        self.insert_mechanism(['ais'], suffix_ais, gbar=na_ais)
+        self.insert_mechanism(['axon', 'boutons'], suffix_axon, gbar=na_axon)  # Axon excluding AIS
 
         print(f"Sodium channels added to {self.cell_name}")
 
     def add_potassium_channels(self):
-        for custom_name, sec in self.sections.items():
-            sec_type = custom_name.split('.')[-1].split('[')[0]
+        # Determine densities based on cell type
+        if self.cell_name == "chc":
+            kv_soma, kv1_soma, kv_dend, kv1_dend, kv1_ais, kv7_ais, kv_axon, kv1_axon = (
+                kv_soma_chc, kv1_soma_chc, kv_dend_chc, kv1_dend_chc, kv1_ais_chc, kv7_ais_chc, kv_axon_chc, kv1_axon_chc)
+            kv7_soma, kv7_dend = 0, 0  # Chandelier cells don’t use Kv7 in soma/dendrites
+        elif self.cell_name == "pyr":
+            kv_soma, kv1_soma, kv_dend, kv1_dend, kv1_ais, kv7_ais, kv_axon, kv1_axon, kv7_soma, kv7_dend = (
+                kv_soma_pyr, kv1_soma_pyr, kv_dend_pyr, kv1_dend_pyr, kv1_ais_pyr, kv7_ais_pyr, kv1_axon_pyr, kv1_axon_pyr, kv7_soma_pyr, kv7_dend_pyr)
 
-            # Determine densities based on cell type
-            if self.cell_name == "chc":
-                kv_soma, kv_dend, kv1_dend, kv1_ais, kv7_ais, kv_axon, kv1_axon = (
-                    kv_soma_chc, kv_dend_chc, kv1_dend_chc, kv1_ais_chc, kv7_ais_chc, kv_axon_chc, kv1_axon_chc)
-                kv7_soma, kv7_dend = 0, 0  # Chandelier cells don’t use Kv7 in soma/dendrites
-            elif self.cell_name == "pyr":
-                kv_soma, kv_dend, kv1_dend, kv1_ais, kv7_ais, kv_axon, kv1_axon, kv7_soma, kv7_dend = (
-                    kv_soma_pyr, kv_dend_pyr, kv1_dend_pyr, kv1_ais_pyr, kv7_ais_pyr, kv1_axon_pyr, kv1_axon_pyr, kv7_soma_pyr, kv7_dend_pyr)
-
-            # Potassium channel insertion
-            if 'soma' in sec_type:
-                sec.insert('Kv1S')
-                sec.gbar_Kv1S = kv1_soma_chc*0.6 if self.cell_name == "chc" else kv1_soma_pyr*0.6
-                sec.insert('Kv')
-                sec.gbar_Kv = kv_soma
-                sec.insert('Kv7_AIS')
-                sec.gbar_Kv7_AIS = kv7_soma  # Now properly assigned
-
-            elif 'dend' in sec_type or 'apic' in sec_type:  # Dendrites and apical dendrites
-                sec.insert('Kv1S')
-                sec.gbar_Kv1S = kv1_dend*0.6
-                sec.insert('Kv')
-                sec.gbar_Kv = kv_dend
-                sec.insert('Kv7_AIS')
-                sec.gbar_Kv7_AIS = kv7_dend  # Now properly assigned
-
-            elif 'axon' in sec_type:
-                if self.cell_name == "pyr" and custom_name.endswith('[0]'):  # AIS of pyramidal cell
-                    sec.insert('Kv1')
-                    sec.gbar_Kv1 = kv1_ais*0.6
-                    sec.insert('Kv7_AIS')
-                    sec.gbar_Kv7_AIS = kv7_ais
-                elif self.cell_name == "chc" and custom_name.endswith('[0]'):  # same properties as soma
-                    sec.insert('Kv1S')
-                    sec.gbar_Kv1S = kv1_soma_chc*0.6
-                    sec.insert('Kv')
-                    sec.gbar_Kv = kv_soma
-                elif self.cell_name == "chc" and custom_name.endswith('[1]'):  # AIS of chandelier cell
-                    sec.insert('Kv1')
-                    sec.gbar_Kv1 = kv1_ais*0.6
-                    sec.insert('Kv7_AIS')
-                    sec.gbar_Kv7_AIS = kv7_ais
-                else:  # Axon excluding AIS
-                    sec.insert('Kv1')
-                    sec.gbar_Kv1 = kv1_axon*0.6
+        # Potassium channel insertion
+        self.insert_mechanism(['soma'], 'Kv1S', gbar=kv1_soma*0.6)
+        self.insert_mechanism(['soma'], 'Kv', gbar=kv_soma)
+        self.insert_mechanism(['soma'], 'Kv7_AIS', gbar=kv7_soma)
+
+        # Dendrites and apical dendrites
+        self.insert_mechanism(['dend', 'apic'], 'Kv1S', gbar=kv1_dend*0.6)
+        self.insert_mechanism(['dend', 'apic'], 'Kv', gbar=kv_dend)
+        self.insert_mechanism(['dend', 'apic'], 'Kv7_AIS', gbar=kv7_dend)
+
+        # ChC axon[0], same properties as soma
+        self.insert_mechanism(['hillock'], 'Kv1S', gbar=kv1_soma*0.6)
+        self.insert_mechanism(['hillock'], 'Kv', gbar=kv_soma)
+
+        self.insert_mechanism(['ais'], 'Kv1', gbar=kv1_ais*0.6)
+        self.insert_mechanism(['ais'], 'Kv7_AIS', gbar=kv7_ais)
+
+        self.insert_mechanism(['axon', 'boutons'], 'Kv1', gbar=kv1_axon*0.6)  # Axon excluding AIS
 
         print(f"Potassium channels added to {self.cell_name}")
 
@@ -284,19 +345,135 @@ class Cell:
         return None
 
     def get_custom_name(self, section):
-        for custom_name, sec in self.sections.items():
-            if sec == section:
-                return custom_name
-        return "Unknown"
-
-
-
-
-
-
-
-
-
-
-
+        return self.section_names.get(section, "Unknown")
 
+    def complexity(self):
+        """Size of the model per region and section type: a list of dicts with cell, region, section_type, sections,
+        nseg, mechanisms (inserted anywhere in them, ions included), states (one voltage per segment plus the STATEs of
+        the mechanisms, as in discretization.count_states) and bytes, an estimate of the memory NEURON uses for them."""
+        rows = {}
+        for sec in self.all:
+            sec_type = self.section_names[sec].split('.')[-1].split('[')[0]
+            key = (self.region_of[sec], sec_type)
+            if key not in rows:
+                rows[key] = {"cell": self.cell_name, "region": key[0], "section_type": sec_type, "sections": 0,
+                             "nseg": 0, "mechanisms": set(), "states": 0, "bytes": 0}
+            row = rows[key]
+            states, segment_bytes = 1, node_bytes
+            for mech in sec(0.5):
+                mech_name = mech.name()
+                n_params, n_assigned, n_states = _mechanism_variables(mech_name)
+                row["mechanisms"].add(mech_name)
+                states += n_states
+                segment_bytes += mechanism_instance_bytes + 8 * (n_params + n_assigned + 2 * n_states)
+            row["sections"] += 1
+            row["nseg"] += sec.nseg
+            row["states"] += states * sec.nseg
+            row["bytes"] += section_bytes + pt3d_bytes * sec.n3d() + segment_bytes * sec.nseg
+
+        order = {region: i for i, region in enumerate(regions)}
+        rows = sorted(rows.values(), key=lambda row: (order.get(row["region"], len(order)), row["section_type"]))
+        for row in rows:
+            row["mechanisms"] = sorted(row["mechanisms"])
+        return rows
+
+    def snapshot(self):
+        """Record everything needed to rebuild this cell: the section tree as loaded, and per section nseg, L,
+        Ra, cm, ion reversal potentials and the inserted density mechanisms with their parameters.
+        Point processes (stimuli, synapses) are not included."""
+        sections = list(self.all)
+        properties = []
+        for sec in sections:
+            mechs = []
+            for mech in sec(0.5):
+                mech_name = mech.name()
+                params = []
+                for param, default in _mechanism_parameters(mech_name):
+                    values = [getattr(seg, param) for seg in sec]
+                    if values.count(default) == len(values):
+                        continue  # a freshly inserted mechanism already has this value
+                    # Store a single value for uniform parameters, so it can be set for the whole section at once
+                    params.append((param, values[0] if values.count(values[0]) == len(values) else values))
+                mechs.append((mech_name, params))
+            ions = [(f"e{ion}", getattr(sec(0.5), f"e{ion}")) for ion in ("na", "k") if h.ismembrane(f"{ion}_ion", sec=sec)]
+            properties.append((sec.nseg, sec.L, sec.Ra, sec.cm, ions, mechs))
+
+        return {
+            "morphology_path": self.morphology_path,
+            "cell_name": self.cell_name,
+            "discretization": self.discretization,
+            "morphology": self.morphology,
+            "properties": properties,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Build a new cell from Cell.snapshot() without parsing, discretizing or adding channels again."""
+        cell = cls.__new__(cls)
+        cell.morphology_path = snapshot["morphology_path"]
+        cell.cell_name = snapshot["cell_name"]
+        cell.use_cache = False
+        cell.cache_dir = None
+        cell.discretization = snapshot["discretization"]
+        cell.all = h.SectionList()
+        cell.soma = None
+        cell.section_types = {}
+        cell.sections = {}
+
+        cell.morphology = snapshot["morphology"]
+
+        sections = morphology_cache.build_sections(cell, cell.morphology)
+        for sec, (nseg, L, Ra, cm, ions, mechs) in zip(sections, snapshot["properties"]):
+            if sec.L != L:
+                sec.L = L  # lengths changed after loading (e.g. the AIS), rescaled from the original points as before
+            sec.nseg = nseg
+            sec.Ra = Ra
+            sec.cm = cm
+            for mech_name, params in mechs:
+                sec.insert(mech_name)
+                for param, value in params:
+                    if isinstance(value, list):
+                        for seg, seg_value in zip(sec, value):
+                            setattr(seg, param, seg_value)
+                    else:
+                        setattr(sec, param, value)
+            for ion_param, value in ions:
+                setattr(sec, ion_param, value)
+
+        cell.index_sections(verbose=False)
+        return cell
+
+    def clone(self):
+        """Return an identical copy of this cell (geometry, nseg and inserted mechanisms with their densities)."""
+        return Cell.from_snapshot(self.snapshot())
+
+    def clones(self, n):
+        """Return n identical copies of this cell, taking the snapshot only once."""
+        snapshot = self.snapshot()
+        return [Cell.from_snapshot(snapshot) for _ in range(n)]
+
+
+_mechanism_parameter_defaults = {}
+
+def _mechanism_parameters(mech_name):
+    """Names and default values of the range PARAMETERs of a density mechanism (e.g. [('gbar_Kv1', 11.0)]),
+    looked up once per mechanism."""
+    if mech_name not in _mechanism_parameter_defaults:
+        ms = h.MechanismStandard(mech_name, 1)
+        params = []
+        for i in range(int(ms.count())):
+            name = h.ref('')
+            ms.name(name, i)
+            params.append((name[0], ms.get(name[0])))
+        _mechanism_parameter_defaults[mech_name] = params
+    return _mechanism_parameter_defaults[mech_name]
+
+
+_mechanism_variable_counts = {}
+
+def _mechanism_variables(mech_name):
+    """Number of range PARAMETERs, ASSIGNED and STATE variables of a density mechanism, looked up once per mechanism."""
+    if mech_name not in _mechanism_variable_counts:
+        _mechanism_variable_counts[mech_name] = tuple(int(h.MechanismStandard(mech_name, vartype).count())
+                                                      for vartype in (1, 2, 3))
+    return _mechanism_variable_counts[mech_name]
@@ -0,0 +1,122 @@
+""" Conduction of the action potential along the ChC axon to its boutons and terminals, for any number of sites.
+
+Activation times come from one run with a NetCon spike detector per site, all recording into two shared vectors
+(recording.record_spike_raster), instead of voltage traces. Results are arrays per site, and per cartridge where the
+sites belong to one (Cell.cartridges()); the means per cartridge are taken with np.bincount. """
+
+import numpy as np
+from neuron import h
+
+import features
+import recording
+
+
+def _node_x(sec, x):
+    """The position h.distance uses for x: the end of the section at 0 and 1, otherwise the middle of its segment."""
+    if x <= 0 or x >= 1:
+        return x
+    return (min(int(x * sec.nseg), sec.nseg - 1) + 0.5) / sec.nseg
+
+
+def path_distances(cell, segments, origin=None):
+    """Path distance (µm) from origin (default: the middle of the soma) to each segment of the cell, as h.distance.
+    One pass over the subtree of the origin section gives the distance to the end of each section that joins its
+    parent (the parent's distance at the connection point); a segment adds its own x * L from there. Segments
+    outside that subtree fall back to h.distance."""
+    if origin is None:
+        origin = cell.soma(0.5)
+    root = origin.sec
+    start = {root: (0.0, _node_x(root, origin.x))}  # section: (distance at the point x0 of the section, x0)
+    stack = [root]
+    while stack:
+        sec = stack.pop()
+        d, x0 = start[sec]
+        for child in sec.children():
+            start[child] = (d + abs(_node_x(sec, child.parentseg().x) - x0) * sec.L, child.orientation())
+            stack.append(child)
+    distances = []
+    for seg in segments:
+        if seg.sec in start:
+            d, x0 = start[seg.sec]
+            distances.append(d + abs(_node_x(seg.sec, seg.x) - x0) * seg.sec.L)
+        else:
+            distances.append(h.distance(origin, seg))
+    return np.array(distances)
+
+
+def terminals(cell, regions=('axon', 'boutons')):
+    """The sections of these regions without children: every tip of the axon."""
+    return [sec for region in regions for sec in cell.regions.get(region, []) if not sec.children()]
+
+
+def sites(cell, which="cartridges"):
+    """Recording sites and the cartridge index of each (-1: in none), for which =
+    'cartridges': the middle of every bouton of Cell.cartridges(), by cartridge from base to tip;
+    'boutons': the middle of every bouton section;
+    'terminals': the tip (x = 1) of every terminal section of the axon."""
+    cartridge_of = {}  # every section from the first bouton of a cartridge to its tip
+    for k, cartridge in enumerate(cell.cartridges()):
+        sec = cartridge[0]
+        while True:
+            cartridge_of[sec] = k
+            children = sec.children()
+            if len(children) != 1:
+                break
+            sec = children[0]
+    if which == "cartridges":
+        sections, x = [sec for cartridge in cell.cartridges() for sec in cartridge], 0.5
+    elif which == "boutons":
+        sections, x = cell.regions.get('boutons', []), 0.5
+    elif which == "terminals":
+        sections, x = terminals(cell), 1
+    else:
+        raise ValueError(f"Unknown sites '{which}'. Available: cartridges, boutons, terminals")
+    return [sec(x) for sec in sections], np.array([cartridge_of.get(sec, -1) for sec in sections], dtype=int)
+
+
+def record_activation(segments, threshold=-20):
+    """Spike detectors (threshold in mV) at the segments; returns a function that gives the first spike time at each
+    segment (NaN if none) after the run. Keep it for as long as you record."""
+    detectors, times, ids = recording.record_spike_raster(segments, threshold)
+
+    def first_times():
+        first = np.full(len(segments), np.nan)
+        ids_array = np.asarray(ids, dtype=int)
+        if len(ids_array):
+            times_array = np.asarray(times)
+            order = np.lexsort((times_array, ids_array))
+            site, index = np.unique(ids_array[order], return_index=True)
+            first[site] = times_array[order][index]
+        return first
+
+    first_times.detectors = detectors
+    return first_times
+
+
+def group_means(groups, values, n_groups):
+    """Mean of values per group (0 ... n_groups - 1), ignoring NaN and values in group -1; NaN for empty groups."""
+    groups, values = np.asarray(groups), np.asarray(values, dtype=float)
+    valid = (groups >= 0) & ~np.isnan(values)
+    counts = np.bincount(groups[valid], minlength=n_groups)
+    sums = np.bincount(groups[valid], values[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def analyze(cell, segments, cartridge, first, soma_spike_time):
+    """Per site and per cartridge conduction results from the first spike times at the sites."""
+    distances = path_distances(cell, segments)
+    delays = first - soma_spike_time
+    velocities = features.conduction_velocities(distances, delays)
+    n_cartridges = max(len(cell.cartridges()), int(np.max(cartridge, initial=-1)) + 1)
+    return {
+        "cartridge": cartridge,
+        "distance": distances,
+        "activation_time": first,
+        "delay": delays,
+        "velocity": velocities,
+        "soma_spike_time": soma_spike_time,
+        "cartridge_distance": group_means(cartridge, distances, n_cartridges),
+        "cartridge_delay": group_means(cartridge, delays, n_cartridges),
+        "cartridge_velocity": group_means(cartridge, velocities, n_cartridges),
+    }
@@ -0,0 +1,66 @@
+""" Search for step currents: rheobase and the current needed for a target firing rate.
+
+The spike count grows with the step amplitude, so "at least n spikes" can be found by bisection, to a precision of
+`precision` nA in about log2((high - low) / precision) runs instead of a fixed amplitude grid. Each run is stopped
+as soon as its answer is known: when the n-th spike is detected, or `tail` ms after the end of the step. """
+
+import math
+
+from neuron import h
+
+from protocols import set_run_parameters, start_run
+
+
+def count_spikes(cell, job, amp, stop_at=None, chunk=5):
+    """Spikes at the soma of `cell` for a step of amp nA (job['delay'], job['dur']), counted until job['tail'] ms
+    after the step, or until stop_at spikes are reached. The run advances in chunks of `chunk` ms (from job['settle']
+    if set, see protocols.start_run)."""
+    set_run_parameters(job)
+
+    stim = h.IClamp(cell.soma(0.5))
+    stim.delay = job["delay"]
+    stim.dur = job["dur"]
+    stim.amp = amp
+
+    ap_counter = h.APCount(cell.soma(0.5))
+    ap_counter.thresh = job["thresh"]  # Spike detection threshold
+
+    t_end = min(job["tstop"], job["delay"] + job["dur"] + job["tail"])
+    start_run([cell], job)
+    while h.t < t_end - h.dt / 2:
+        h.continuerun(min(h.t + chunk, t_end))
+        if stop_at is not None and ap_counter.n >= stop_at:
+            break
+    return int(ap_counter.n)
+
+
+def bisect_current(reaches, low, high, precision):
+    """Smallest amplitude in (low, high] for which reaches(amp) is True, to within precision nA, assuming reaches()
+    is False below and True above it. Returns (amplitude, number of runs); the amplitude is NaN if even high does
+    not reach."""
+    runs = 1
+    if not reaches(high):
+        return math.nan, runs
+    while high - low > precision:
+        mid = (low + high) / 2
+        runs += 1
+        if reaches(mid):
+            high = mid
+        else:
+            low = mid
+    return high, runs
+
+
+def spikes_needed(target_hz, dur):
+    """Spike count of a step of dur ms that corresponds to target_hz (the I-F curve's count / duration)."""
+    return max(1, math.ceil(target_hz * dur / 1000 - 1e-9))
+
+
+def find_current(cells, job):
+    """Job function for parallel.run_jobs (setup: protocols.build_cells): the step current on job['cell'] for
+    job['target_hz'] Hz, or its rheobase if target_hz is None, searched between job['low'] and job['high']."""
+    cell = cells[job["cell"]]
+    n_spikes = 1 if job.get("target_hz") is None else spikes_needed(job["target_hz"], job["dur"])
+    amp, runs = bisect_current(lambda amp: count_spikes(cell, job, amp, stop_at=n_spikes) >= n_spikes,
+                               job["low"], job["high"], job["precision"])
+    return {"amp": amp, "runs": runs, "spikes": n_spikes}
@@ -0,0 +1,161 @@
+""" Discretization policies for Cell.discretize().
+
+A policy gives a rule per region (see Cell.region_of_section) and optionally per named section:
+  ('length', L)              one segment per ~L µm
+  ('d_lambda', d, f, min)    d_lambda rule: segments no longer than d * lambda at frequency f (Hz), at least min
+nseg is always odd. lambda is that of the section itself (the original discretize() took it from the currently
+accessed section, the first cell's soma, so meshes depended on the build order). The 'reference' preset has the
+original hard-coded rules; 'fast' and 'ultra_fast' are coarser meshes for large sweeps. Use discretization_report()
+(or tools/discretization_report.py) to check their segment count, cost per step and voltage error against the
+reference before using them. """
+
+import time
+
+import numpy as np
+from neuron import h
+
+import features
+
+
+def length_rule(length):
+    return ('length', length)
+
+
+def d_lambda_rule(d_lambda, frequency, min_seg=3):
+    return ('d_lambda', d_lambda, frequency, min_seg)
+
+
+class DiscretizationPolicy:
+    def __init__(self, name, regions, sections=None, default=None):
+        """regions: {region: rule}; sections: {cell_name: {section name: rule}} (e.g. {'pyr': {'dend[12]': ...}});
+        default: rule for regions without one."""
+        self.name = name
+        self.regions = dict(regions)
+        self.sections = {cell_name: dict(rules) for cell_name, rules in (sections or {}).items()}
+        self.default = default if default is not None else d_lambda_rule(0.1, 3000)
+
+    def __repr__(self):
+        return f"DiscretizationPolicy({self.name!r})"
+
+    def with_overrides(self, name=None, sections=None, **regions):
+        """Copy of this policy with some region (or section) rules replaced, e.g. policy.with_overrides(ais=length_rule(1))."""
+        policy = DiscretizationPolicy(name or f"{self.name}+overrides", {**self.regions, **regions}, self.sections, self.default)
+        for cell_name, rules in (sections or {}).items():
+            policy.sections.setdefault(cell_name, {}).update(rules)
+        return policy
+
+    def rule(self, cell, sec):
+        sec_name = sec.name().split('.')[-1]
+        rule = self.sections.get(cell.cell_name, {}).get(sec_name)
+        if rule is None:
+            rule = self.regions.get(cell.region_of[sec], self.default)
+        return rule
+
+    def nseg(self, cell, sec):
+        rule = self.rule(cell, sec)
+        if rule[0] == 'length':
+            nseg = int((sec.L / rule[1]) + 0.999)
+            if nseg % 2 == 0:
+                nseg += 1  # Make sure nseg is odd
+            return nseg
+        if rule[0] == 'd_lambda':
+            _, d_lambda, frequency, min_seg = rule
+            nseg = int((sec.L / (d_lambda * h.lambda_f(frequency, sec=sec)) + 0.999) / 2) * 2 + 1
+            return max(nseg, min_seg)
+        raise ValueError(f"Unknown discretization rule: {rule}")
+
+
+presets = {
+    # 1 µm segments in the AIS and at the dendritic synapse site, 10 µm in the rest of the axon
+    'reference': DiscretizationPolicy(
+        'reference',
+        regions={'ais': length_rule(1), 'hillock': length_rule(10), 'axon': length_rule(10), 'boutons': length_rule(10)},
+        sections={'pyr': {'dend[12]': length_rule(1)}},
+        default=d_lambda_rule(0.1, 3000)),
+    'fast': DiscretizationPolicy(
+        'fast',
+        regions={'ais': length_rule(2), 'hillock': length_rule(10), 'axon': length_rule(20), 'boutons': length_rule(10)},
+        sections={'pyr': {'dend[12]': length_rule(5)}},
+        default=d_lambda_rule(0.3, 1000)),
+    'ultra_fast': DiscretizationPolicy(
+        'ultra_fast',
+        regions={'ais': length_rule(2), 'hillock': length_rule(10), 'axon': length_rule(50), 'boutons': length_rule(50)},
+        default=d_lambda_rule(0.5, 100, min_seg=1)),
+}
+
+
+def get_policy(policy=None):
+    """Return a DiscretizationPolicy from a preset name, a policy, or None (the reference preset)."""
+    if policy is None:
+        return presets['reference']
+    if isinstance(policy, str):
+        if policy not in presets:
+            raise ValueError(f"Unknown discretization preset '{policy}'. Available: {', '.join(presets)}")
+        return presets[policy]
+    return policy
+
+
+def count_states(cell):
+    """Number of state variables of the cell (one voltage per segment plus the STATEs of every inserted mechanism),
+    a static estimate of the work per time step."""
+    n_states = {}
+    total = 0
+    for sec in cell.all:
+        states = 1
+        for mech in sec(0.5):
+            name = mech.name()
+            if name not in n_states:
+                n_states[name] = int(h.MechanismStandard(name, 3).count())
+            states += n_states[name]
+        total += states * sec.nseg
+    return total
+
+
+def discretization_report(cell_factory, policies=('reference', 'fast', 'ultra_fast'), amplitude=None,
+                          delay=5, duration=5, tstop=40, dt=0.025, v_init=-90, celsius=34, sample_dt=0.025):
+    """Compare discretization policies for one cell type.
+
+    cell_factory(policy) must return a fully built Cell (channels added) using that policy. Each policy is simulated
+    on its own with a soma current pulse; soma and AIS voltage are sampled every sample_dt ms and compared to the
+    first policy in the list. Returns a list of dicts with the segment count, state count, measured wall time per
+    step and the max/RMS voltage error and first-spike shift at soma and AIS.
+    """
+    h.dt = dt
+    h.celsius = celsius
+    rows = []
+    reference = None
+    for policy in policies:
+        policy = get_policy(policy)
+        cell = cell_factory(policy)
+        ais = cell.regions['ais'][0] if cell.regions['ais'] else cell.soma
+        stim = cell.apply_stimulus(delay, duration, amplitude if amplitude is not None else (0.3 if cell.cell_name == "chc" else 0.6))
+        v_soma = h.Vector().record(cell.soma(0.5)._ref_v, sample_dt)
+        v_ais = h.Vector().record(ais(0.5)._ref_v, sample_dt)
+
+        h.finitialize(v_init)
+        start = time.perf_counter()
+        h.continuerun(tstop)
+        wall = time.perf_counter() - start
+
+        traces = {'soma': np.array(v_soma), 'ais': np.array(v_ais)}
+        row = {
+            'policy': policy.name,
+            'cell': cell.cell_name,
+            'nseg': sum(sec.nseg for sec in cell.all),
+            'states': count_states(cell),
+            'ms_per_step': 1000 * wall / (tstop / dt),
+        }
+        if reference is None:
+            reference = traces
+        for site, v in traces.items():
+            ref = reference[site]
+            n = min(len(v), len(ref))
+            err = v[:n] - ref[:n]
+            row[f'{site}_max_error_mV'] = float(np.max(np.abs(err)))
+            row[f'{site}_rms_error_mV'] = float(np.sqrt(np.mean(err ** 2)))
+            spike = features.first_crossing(np.arange(n) * sample_dt, [v[:n], ref[:n]], threshold=0)
+            row[f'{site}_spike_shift_ms'] = float(spike[0] - spike[1])
+        rows.append(row)
+
+        del stim, v_soma, v_ais, cell  # free the sections before building the next mesh
+    return rows
@@ -0,0 +1,349 @@
+""" Electrophysiology features of voltage traces, computed for many traces at once.
+
+Functions take v as a 2-D array (traces x samples; a single 1-D trace counts as one row) sampled at the times t
+(1-D, shared by all traces) or every dt ms. Per-trace results are 1-D arrays with NaN where a feature does not exist
+(e.g. no spike). Results with a variable number of values per trace (spike times, ISIs) are returned as a flat array
+of values and an array with the trace index of each value; split_rows() turns them into one array per trace.
+Spike times follow the convention of the scripts: the time of the sample just before an upward threshold crossing. """
+
+import numpy as np
+
+
+def _traces(v):
+    return np.atleast_2d(np.asarray(v))
+
+
+def split_rows(rows, values, n_traces):
+    """One array of values per trace, from (trace index, value) arrays sorted by trace."""
+    return np.split(values, np.searchsorted(rows, np.arange(1, n_traces)))
+
+
+def crossings(v, threshold):
+    """Boolean (traces x samples - 1) array, True at i where v crosses threshold upwards between samples i and i + 1."""
+    v = _traces(v)
+    return (v[:, :-1] < threshold) & (v[:, 1:] >= threshold)
+
+
+def spike_times(t, v, threshold=-20):
+    """All upward crossings of threshold; returns (trace index, time) sorted by trace and time."""
+    rows, cols = np.nonzero(crossings(v, threshold))
+    return rows, np.asarray(t)[cols]
+
+
+def spike_counts(t, v, threshold=-20, start=-np.inf, stop=np.inf):
+    """Number of crossings per trace with start <= spike time <= stop."""
+    t = np.asarray(t)[:-1]
+    return np.count_nonzero(crossings(v, threshold) & ((t >= start) & (t <= stop)), axis=1)
+
+
+def first_crossing(t, v, threshold=-20):
+    """Time of the first crossing per trace (NaN if none), e.g. the first-spike latency or a bouton activation time."""
+    c = crossings(v, threshold)
+    return np.where(c.any(axis=1), np.asarray(t)[c.argmax(axis=1)], np.nan)
+
+
+def isis(rows, times):
+    """Inter-spike intervals from the output of spike_times(); returns (trace index, interval)."""
+    same = rows[1:] == rows[:-1]
+    return rows[1:][same], np.diff(times)[same]
+
+
+def vm_stats(t, v, start=-np.inf, stop=np.inf):
+    """Mean and standard deviation of v per trace over the samples with start < t <= stop."""
+    t = np.asarray(t)
+    window = _traces(v)[:, (t > start) & (t <= stop)]
+    return np.mean(window, axis=1), np.std(window, axis=1)
+
+
+def dvdt(v, dt):
+    """dV/dt (mV/ms) per sample, by central differences."""
+    return np.gradient(_traces(v), dt, axis=1)
+
+
+def _windows(v, start, n):
+    """The n samples of each trace from index start (per trace) on, repeating the last sample past the end."""
+    index = np.minimum(start[:, None] + np.arange(n), v.shape[1] - 1)
+    return np.take_along_axis(v, index, axis=1)
+
+
+def ap_features(v, dt, dvdt_threshold=20, window=3):
+    """Features of the first action potential of each trace, where dV/dt first reaches dvdt_threshold (mV/ms):
+    threshold (mV) and its time index, peak and amplitude above threshold (mV) within `window` ms, half-width (ms,
+    at half amplitude, linearly interpolated) and the maximal dV/dt of the trace. NaN for traces without an AP."""
+    v = _traces(v).astype(float)
+    slope = dvdt(v, dt)
+    above = slope >= dvdt_threshold
+    has_ap = above.any(axis=1)
+    onset = above.argmax(axis=1)
+    rows = np.arange(len(v))
+
+    n = max(2, int(round(window / dt)) + 1)
+    segment = _windows(v, onset, n)
+    v_threshold = v[rows, onset]
+    peak = segment.max(axis=1)
+    amplitude = peak - v_threshold
+    half = (v_threshold + amplitude / 2)[:, None]
+
+    # Rising and falling crossings of half amplitude within the window, interpolated between samples
+    up = segment[:, :-1] < half
+    up &= segment[:, 1:] >= half
+    down = (segment[:, :-1] >= half) & (segment[:, 1:] < half)
+    down &= np.arange(n - 1) >= up.argmax(axis=1)[:, None]
+    i_up, i_down = up.argmax(axis=1), down.argmax(axis=1)
+
+    def interpolate(i):
+        v0, v1 = segment[rows, i], segment[rows, i + 1]
+        return (i + (half[:, 0] - v0) / (v1 - v0)) * dt
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        half_width = np.where(up.any(axis=1) & down.any(axis=1), interpolate(i_down) - interpolate(i_up), np.nan)
+
+    return {
+        "threshold": np.where(has_ap, v_threshold, np.nan),
+        "threshold_index": np.where(has_ap, onset, -1),
+        "peak": np.where(has_ap, peak, np.nan),
+        "amplitude": np.where(has_ap, amplitude, np.nan),
+        "half_width": np.where(has_ap, half_width, np.nan),
+        "max_dvdt": slope.max(axis=1),
+    }
+
+
+def phase_features(t, v, slope, dvdt_threshold=20, kink_dvdt=50, window=3, spike_threshold=-20):
+    """Phase-plot (dV/dt against V) features of the first action potential of each trace, from v and its dV/dt
+    (slope, mV/ms; e.g. dvdt(v, dt) or i_cap / cm) sampled at the times t (regular steps). The AP is the first
+    crossing of spike_threshold (mV); its threshold (mV) and time are where slope last reaches dvdt_threshold (mV/ms)
+    before it, so that fast charging at a current step is not taken for the AP. Onset rapidity (1/ms) is the slope of
+    the phase plot at the kink, fitted from the sample before threshold through the first sample at kink_dvdt.
+    Within `window` ms from threshold: the peak (mV), the maximal rise and fall rates (mV/ms) and the voltages at which
+    they occur. NaN for traces without an AP."""
+    t = np.asarray(t)
+    v, slope = _traces(v).astype(float), _traces(slope).astype(float)
+    spike = crossings(v, spike_threshold)
+    has_ap = spike.any(axis=1)
+    samples = np.arange(v.shape[1])
+    below = (slope < dvdt_threshold) & (samples <= np.where(has_ap, spike.argmax(axis=1), -1)[:, None])
+    onset = np.where(below.any(axis=1), v.shape[1] - below[:, ::-1].argmax(axis=1), 0)
+    onset = np.minimum(onset, v.shape[1] - 1)
+    rows = np.arange(len(v))
+
+    n = max(2, int(round(window / (t[1] - t[0]))) + 1)
+    v_window, slope_window = _windows(v, onset, n), _windows(slope, onset, n)
+    i_rise, i_fall = slope_window.argmax(axis=1), slope_window.argmin(axis=1)
+
+    # Least-squares slope of dV/dt against V around the kink
+    start = np.maximum(onset - 1, 0)
+    v_kink, slope_kink = _windows(v, start, n), _windows(slope, start, n)
+    at_kink = slope_kink >= kink_dvdt
+    fitted = (np.cumsum(at_kink, axis=1) - at_kink) == 0  # up to and including the first sample at kink_dvdt
+    count = fitted.sum(axis=1)
+    v_kink, slope_kink = np.where(fitted, v_kink, 0), np.where(fitted, slope_kink, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        v_mean, slope_mean = v_kink.sum(axis=1) / count, slope_kink.sum(axis=1) / count
+        covariance = (v_kink * slope_kink).sum(axis=1) / count - v_mean * slope_mean
+        variance = (v_kink ** 2).sum(axis=1) / count - v_mean ** 2
+        rapidity = np.where(count >= 2, covariance / variance, np.nan)
+
+    def per_ap(values):
+        return np.where(has_ap, values, np.nan)
+
+    return {
+        "threshold": per_ap(v[rows, onset]),
+        "threshold_time": per_ap(t[onset]),
+        "onset_rapidity": per_ap(rapidity),
+        "peak": per_ap(v_window.max(axis=1)),
+        "max_rise": per_ap(slope_window[rows, i_rise]),
+        "v_max_rise": per_ap(v_window[rows, i_rise]),
+        "max_fall": per_ap(slope_window[rows, i_fall]),
+        "v_max_fall": per_ap(v_window[rows, i_fall]),
+    }
+
+
+def exp_decay(t, V0, tau, Vinf):
+    return Vinf + (V0 - Vinf) * np.exp(-t / tau)
+
+
+def _fit_linear(e, y):
+    """Least-squares a, b of y = a + b * e per row, and the residual sum of squares."""
+    e_mean = e.mean(axis=1, keepdims=True)
+    y_mean = y.mean(axis=1, keepdims=True)
+    b = np.sum((e - e_mean) * (y - y_mean), axis=1, keepdims=True) / np.sum((e - e_mean) ** 2, axis=1, keepdims=True)
+    a = y_mean - b * e_mean
+    return a[:, 0], b[:, 0], np.sum((y - a - b * e) ** 2, axis=1)
+
+
+def fit_tau(t, v, start, stop, tau_range=(0.1, None), n_iter=50):
+    """Least-squares fit of exp_decay(t - start, V0, tau, Vinf) to every trace over start <= t <= stop, all traces
+    at once. For a given tau the fit is linear in V0 and Vinf, so only tau is searched (golden section on log tau
+    within tau_range; the default upper bound is 10 times the fit window). Returns per-trace V0, tau (ms) and Vinf."""
+    t = np.asarray(t)
+    window = (t >= start) & (t <= stop)
+    x = t[window] - start
+    y = _traces(v)[:, window].astype(float)
+
+    m = y.shape[1]
+    y_centered = y - y.mean(axis=1, keepdims=True)
+    y_var = np.sum(y_centered ** 2, axis=1)
+
+    def sse(log_tau):
+        # residual of the linear fit: var(y) - cov(e, y)^2 / var(e), from sums
+        e = np.exp(-x / np.exp(log_tau)[:, None])
+        e_sum = e.sum(axis=1)
+        cov = np.einsum('ij,ij->i', e, y_centered)
+        return y_var - cov ** 2 / (np.einsum('ij,ij->i', e, e) - e_sum ** 2 / m)
+
+    low = np.full(len(y), np.log(tau_range[0]))
+    high = np.full(len(y), np.log(tau_range[1] if tau_range[1] is not None else 10 * (stop - start)))
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = high - ratio * (high - low), low + ratio * (high - low)
+    sse_a, sse_b = sse(a), sse(b)
+    for _ in range(n_iter):
+        left = sse_a < sse_b  # the minimum is in [low, b], otherwise in [a, high]
+        high = np.where(left, b, high)
+        low = np.where(left, low, a)
+        a, b = np.where(left, high - ratio * (high - low), b), np.where(left, a, low + ratio * (high - low))
+        new = sse(np.where(left, a, b))
+        sse_a, sse_b = np.where(left, new, sse_b), np.where(left, sse_a, new)
+    tau = np.exp((low + high) / 2)
+    Vinf, amplitude, residual = _fit_linear(np.exp(-x / tau[:, None]), y)
+    return {"V0": Vinf + amplitude, "tau": tau, "Vinf": Vinf, **_fit_quality(residual, y_var, m)}
+
+
+def _fit_quality(residual, y_var, m):
+    """RMSE (mV) and R^2 of a fit from its residual sum of squares, the data's sum of squared deviations from the
+    mean and the number of samples."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {"rmse": np.sqrt(residual / m), "r2": 1 - residual / y_var}
+
+
+def _bic(residual, m, n_parameters):
+    """Bayesian information criterion of least-squares fits from their residual sum of squares, the number of
+    samples and of fitted parameters; a smaller value is a better fit for its number of parameters. Residuals below
+    1 µV RMS count as exact fits, so that rounding errors do not pass for an improvement."""
+    return m * np.log(np.maximum(residual / m, 1e-12)) + n_parameters * np.log(m)
+
+
+def multi_exp_decay(t, Vinf, amplitudes, taus):
+    """Vinf + sum_k amplitudes[k] * exp(-t / taus[k]) per trace: t (samples), the rest per trace (x components)."""
+    return Vinf[:, None] + np.einsum('ik,ikj->ij', amplitudes, np.exp(-t[None, None, :] / taus[:, :, None]))
+
+
+def peel_exponentials(t, v, start, stop, n_exp=2, tail=0.5, min_r2=0.999, refine=True, min_separation=1.5):
+    """Fit Vinf + sum of n_exp exponentials to every trace over start <= t <= stop, by exponential peeling: the
+    slowest component and Vinf are fitted (fit_tau) to the last `tail` of the window, subtracted, and each faster
+    component is then fitted to the log of what remains over the first half of the previous component's window
+    (weighted linear least squares, all traces at once). Components are only used where they are needed: a trace
+    keeps the single exponential of fit_tau() over the whole window unless the peeled fit is significantly better
+    (a lower Bayesian information criterion, which charges each extra component for its two parameters), its
+    amplitudes all have the same sign and its time constants are longer than a sample, no longer than the window
+    and at least min_separation times apart. Traces still fitted with R^2 below min_r2 are refined with
+    scipy.optimize.curve_fit from the peeled values (if refine and scipy is installed), with the time constants
+    bounded to the window and the amplitudes to the sign of the decay, on the same conditions. Returns per trace
+    Vinf, tau and amplitude (traces x n_exp, slowest first, NaN for unused components; amplitudes at t = start),
+    rmse, r2, the number of components used and whether curve_fit was used."""
+    t = np.asarray(t)
+    window = (t >= start) & (t <= stop)
+    x = t[window] - start
+    y = _traces(v)[:, window].astype(float)
+    n = len(y)
+
+    taus, amplitudes = np.full((n, n_exp), np.nan), np.full((n, n_exp), np.nan)
+    tail_start = (1 - tail) * (stop - start)
+    slow = fit_tau(t, v, start + tail_start, stop)
+    Vinf = slow["Vinf"]
+    taus[:, 0] = slow["tau"]
+    amplitudes[:, 0] = (slow["V0"] - Vinf) * np.exp(tail_start / slow["tau"])
+
+    span = tail_start
+    for k in range(1, n_exp):
+        rest = y - multi_exp_decay(x, Vinf, amplitudes[:, :k], taus[:, :k])
+        part = x <= span
+        sign = np.sign(rest[:, :1])
+        r = rest[:, part] * sign  # positive where it has the sign of the component
+        w = np.where(r > 0, r ** 2, 0)  # weights for the fit of log(r); larger residuals are less noisy
+        log_r = np.log(np.where(r > 0, r, 1))
+        w_sum = w.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_mean = (w * x[part]).sum(axis=1) / w_sum
+            log_mean = (w * log_r).sum(axis=1) / w_sum
+            slope = ((w * (x[part] - x_mean[:, None]) * (log_r - log_mean[:, None])).sum(axis=1)
+                     / (w * (x[part] - x_mean[:, None]) ** 2).sum(axis=1))
+            taus[:, k] = np.where(slope < 0, -1 / slope, np.nan)
+            amplitudes[:, k] = np.where(slope < 0, sign[:, 0] * np.exp(log_mean - slope * x_mean), np.nan)
+        span /= 2
+
+    tau_bounds = (x[1] - x[0], x[-1])  # time constants the samples of the window can resolve
+
+    def plausible(amplitudes, taus):
+        """Whether all time constants of a row are within tau_bounds and at least min_separation times apart, and
+        all amplitudes have the same sign; closer or longer time constants trade off against each other with large
+        amplitudes of opposite sign."""
+        amplitudes, taus = np.atleast_2d(amplitudes), np.atleast_2d(taus)
+        ordered = np.sort(taus, axis=1)
+        with np.errstate(invalid='ignore'):
+            return (~np.isnan(ordered).any(axis=1) & (ordered[:, 0] >= tau_bounds[0])
+                    & (ordered[:, -1] <= tau_bounds[1])
+                    & np.all(ordered[:, 1:] >= min_separation * ordered[:, :-1], axis=1)
+                    & np.all(amplitudes * amplitudes[:, :1] > 0, axis=1))
+
+    def sse(Vinf, amplitudes, taus):
+        fitted = ~np.isnan(taus)  # components that are not used are left out
+        model = multi_exp_decay(x, Vinf, np.where(fitted, amplitudes, 0), np.where(fitted, taus, 1))
+        return np.sum((y - model) ** 2, axis=1)
+
+    # One exponential over the whole window where the peeled components are implausible or not significantly better
+    single = fit_tau(t, v, start, stop)
+    better = (_bic(sse(Vinf, amplitudes, taus), len(x), 1 + 2 * n_exp)
+              < _bic(single["rmse"] ** 2 * len(x), len(x), 3))
+    one = ~(plausible(amplitudes, taus) & better)
+    peeled = Vinf.copy(), amplitudes.copy(), taus.copy()
+    Vinf[one] = single["Vinf"][one]
+    taus[one], amplitudes[one] = np.nan, np.nan
+    taus[one, 0], amplitudes[one, 0] = single["tau"][one], (single["V0"] - single["Vinf"])[one]
+
+    y_var = np.sum((y - y.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    fit = _fit_quality(sse(Vinf, amplitudes, taus), y_var, len(x))
+    refined = np.zeros(n, dtype=bool)
+    poor = ~(fit["r2"] >= min_r2)
+    if refine and n_exp > 1 and poor.any():
+        try:
+            from scipy.optimize import curve_fit
+        except ImportError:  # scipy is optional: keep the fits above
+            curve_fit = None
+
+        def model(x, Vinf, *parameters):
+            return multi_exp_decay(x, np.array([Vinf]), np.array([parameters[:n_exp]]),
+                                   np.array([parameters[n_exp:]]))[0]
+
+        n_components = (~np.isnan(taus)).sum(axis=1)
+        for i in np.flatnonzero(poor) if curve_fit is not None else []:
+            sign = np.sign(y[i, 0] - Vinf[i]) or 1  # of every component of the decay
+            p0 = [peeled[0][i], *np.abs(np.nan_to_num(peeled[1][i])) * sign,
+                  *np.clip(np.nan_to_num(peeled[2][i], nan=1), *tau_bounds)]
+            bounds = ([-np.inf] + [-np.inf if sign < 0 else 0] * n_exp + [tau_bounds[0]] * n_exp,
+                      [np.inf] + [0 if sign < 0 else np.inf] * n_exp + [tau_bounds[1]] * n_exp)
+            try:
+                p, _ = curve_fit(model, x, y[i], p0=p0, bounds=bounds, max_nfev=2000)
+            except (RuntimeError, ValueError):  # no convergence, or NaN in the trace
+                continue
+            if (plausible(p[1:n_exp + 1], p[n_exp + 1:])[0]
+                    and _bic(np.sum((y[i] - model(x, *p)) ** 2), len(x), 1 + 2 * n_exp)
+                    < _bic(fit["rmse"][i] ** 2 * len(x), len(x), 1 + 2 * n_components[i])):
+                Vinf[i], amplitudes[i], taus[i], refined[i] = p[0], p[1:n_exp + 1], p[n_exp + 1:], True
+        fit = _fit_quality(sse(Vinf, amplitudes, taus), y_var, len(x))
+
+    order = np.argsort(-np.nan_to_num(taus, nan=-np.inf), axis=1)  # slowest first, unused components last
+    return {"Vinf": Vinf, "tau": np.take_along_axis(taus, order, 1),
+            "amplitude": np.take_along_axis(amplitudes, order, 1), **fit,
+            "n_components": (~np.isnan(taus)).sum(axis=1), "refined": refined}
+
+
+def conduction_delays(t, v, reference_time, threshold=-20):
+    """Delay (ms) from reference_time (e.g. the soma spike time) to the first crossing at each site (rows of v)."""
+    return first_crossing(t, v, threshold) - reference_time
+
+
+def conduction_velocities(distances, delays):
+    """Conduction velocity in m/s from path distances (µm) and delays (ms); NaN for non-positive delays."""
+    delays = np.asarray(delays, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(delays > 0, (np.asarray(distances) / 1000) / delays, np.nan)
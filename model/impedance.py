@@ -0,0 +1,59 @@
+""" Input and transfer impedance for many locations and frequencies, from NEURON's Impedance tool, without
+time-domain simulation.
+
+The Impedance tool linearizes the cells around their present state (conductances, gating and voltage; initialize or
+settle the model first) and solves for the steady-state response to a sinusoidal current at one location (set by
+loc()). One compute() per reference location and frequency gives the impedances to every other location, so
+compute() and transfer_matrix() loop over frequencies and references only and read all sites from each solution.
+Impedances are in MOhm (at 0 Hz the input impedance is the input resistance), phases in radians. """
+
+import re
+
+import numpy as np
+from neuron import h
+
+
+def segment(cell, location):
+    """The segment of the cell at a location given as 'section(x)' or 'section' (x = 0.5), e.g. 'axon[0](0.3)',
+    'soma' (for soma[0]) or 'dend[12](0.5)'."""
+    match = re.fullmatch(r"\s*([\w\[\]]+?)\s*(?:\(\s*([0-9.]+)\s*\))?\s*", location)
+    name = f"{cell.cell_name}.{match.group(1)}" if match else None
+    if name not in cell.sections and f"{name}[0]" in cell.sections:
+        name = f"{name}[0]"  # 'soma' for soma[0]
+    if name not in cell.sections:
+        raise ValueError(f"No section '{location}' in {cell.cell_name}")
+    return cell.sections[name](float(match.group(2)) if match.group(2) else 0.5)
+
+
+def compute(sites, frequencies, reference, extended=False):
+    """Impedances at each of the segments in sites, for each frequency (Hz), with current injected at (or the
+    voltage measured at) the reference segment. Returns (frequencies x sites) arrays:
+    'input', 'input_phase': input impedance at the site;
+    'transfer', 'transfer_phase': |v(reference) / i(site)| = |v(site) / i(reference)|;
+    'ratio': voltage attenuation |v(reference) / v(site)| for current injected at the site.
+    extended=True includes the gating of the active channels in the linearization (slower)."""
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+    shape = (len(frequencies), len(sites))
+    results = {name: np.empty(shape) for name in ("input", "input_phase", "transfer", "transfer_phase", "ratio")}
+    impedance = h.Impedance()
+    impedance.loc(reference)
+    for i, frequency in enumerate(frequencies):
+        impedance.compute(frequency, int(extended))
+        for j, seg in enumerate(sites):
+            results["input"][i, j] = impedance.input(seg.x, sec=seg.sec)
+            results["input_phase"][i, j] = impedance.input_phase(seg.x, sec=seg.sec)
+            results["transfer"][i, j] = impedance.transfer(seg.x, sec=seg.sec)
+            results["transfer_phase"][i, j] = impedance.transfer_phase(seg.x, sec=seg.sec)
+            results["ratio"][i, j] = impedance.ratio(seg.x, sec=seg.sec)
+    results["frequency"] = frequencies
+    return results
+
+
+def transfer_matrix(sites, frequencies, extended=False):
+    """Transfer impedance between every pair of sites: a (frequencies x sites x sites) array, symmetric in the last
+    two axes, with the input impedances on the diagonal."""
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=float))
+    matrix = np.empty((len(frequencies), len(sites), len(sites)))
+    for k, reference in enumerate(sites):
+        matrix[:, k, :] = compute(sites, frequencies, reference, extended)["transfer"]
+    return matrix
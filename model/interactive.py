@@ -0,0 +1,38 @@
+""" Interactive and headless mode.
+
+The model layer (cells_def, protocols, parallel, ...) imports neither the NEURON GUI nor matplotlib or tkinter, so it
+starts quickly and runs on compute nodes without a display. Scripts that show NEURON graphs or xpanel controls call
+gui(), which loads the NEURON GUI and returns True only in interactive mode; scripts that plot get matplotlib from
+pyplot(), which selects the non-interactive Agg backend in headless mode (figures can still be saved).
+
+Headless mode is on when the environment variable HEADLESS is set to anything but "" or "0", or on Linux when there
+is no display (DISPLAY / WAYLAND_DISPLAY unset). HEADLESS=0 forces interactive mode. """
+
+import os
+import sys
+
+
+def headless():
+    """True if graphs, panels and plot windows should not be created."""
+    flag = os.environ.get("HEADLESS")
+    if flag is not None:
+        return flag not in ("", "0")
+    return sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def gui():
+    """Load the NEURON GUI (as `from neuron import gui` does) unless headless; returns True if it was loaded, i.e.
+    if the script should build its Graphs and xpanels."""
+    if headless():
+        return False
+    import neuron.gui  # noqa: F401  (starts the GUI event loop)
+    return True
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on first use; with the Agg backend in headless mode."""
+    import matplotlib
+    if headless():
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
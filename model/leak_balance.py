@@ -0,0 +1,111 @@
+""" Leak reversal balancing: set e_pas per segment so that the whole cell rests at a target potential.
+
+At v = v_rest, with every gate at its steady state (h.finitialize), a segment is at rest when the leak cancels its
+other membrane currents, g_pas * (v - e_pas) + ina + ik + Ih = 0, so e_pas = v + (ina + ik + Ih) / g_pas. The ih
+current is Ih_ih (NONSPECIFIC_CURRENT Ih in h.mod). The currents of all segments are gathered with PtrVectors, e_pas
+is computed for all segments at once and scattered back.
+
+The cell is then let to settle (at a coarse fixed time step; Kv does not allow CVode) and the rest potential of every
+segment checked; while one is further than tol from v_rest, e_pas is moved by the remaining error and the cell
+settled again. A balanced profile can be saved as JSON and applied to a newly built cell of the same morphology and
+discretization. """
+
+import json
+
+import numpy as np
+from neuron import h
+
+from result_cache import model_fingerprint
+
+currents = (("na_ion", "_ref_ina"), ("k_ion", "_ref_ik"), ("ih", "_ref_Ih_ih"))
+
+
+class _Pointers:
+    """PtrVectors to v, g_pas, e_pas and the currents of every segment with pas."""
+
+    def __init__(self, cell):
+        self.segments = [seg for sec in cell.all if h.ismembrane("pas", sec=sec) for seg in sec]
+        n = len(self.segments)
+        self._zero = h.Vector(1)  # stands in for a current a segment does not have
+        self.v, self.g_pas, self.e_pas = h.PtrVector(n), h.PtrVector(n), h.PtrVector(n)
+        self.currents = [h.PtrVector(n) for _ in currents]
+        has = {mech: [h.ismembrane(mech, sec=seg.sec) for seg in self.segments] for mech, _ in currents}
+        for i, seg in enumerate(self.segments):
+            self.v.pset(i, seg._ref_v)
+            self.g_pas.pset(i, seg._ref_g_pas)
+            self.e_pas.pset(i, seg._ref_e_pas)
+            for pointers, (mech, ref) in zip(self.currents, currents):
+                pointers.pset(i, getattr(seg, ref) if has[mech][i] else self._zero._ref_x[0])
+
+    def gather(self, pointers):
+        values = h.Vector(len(self.segments))
+        pointers.gather(values)
+        return values.as_numpy().copy()
+
+    def scatter(self, pointers, values):
+        pointers.scatter(h.Vector(values))
+
+
+def _settle(v_rest, settle, dt):
+    """Initialize every cell at v_rest and run to t = settle (ms) with a fixed time step dt."""
+    previous_dt = h.dt
+    h.dt = dt
+    h.finitialize(v_rest)
+    h.continuerun(settle)
+    h.dt = previous_dt
+
+
+def balance(cell, v_rest, tol=0.1, settle=200, dt=0.1, max_iter=10):
+    """Set e_pas of every segment of the cell so that it rests at v_rest (mV), within tol (mV) after settling for
+    settle ms at time step dt. All cells in the model are initialized. Returns a dict with e_pas and the settled v
+    per segment (in the order of cell_segments()), the number of settling runs and the largest remaining error."""
+    pointers = _Pointers(cell)
+    h.finitialize(v_rest)
+    h.fcurrent()
+    g_pas = pointers.gather(pointers.g_pas)
+    e_pas = pointers.gather(pointers.e_pas)
+    total = sum(pointers.gather(currents) for currents in pointers.currents)
+    active = g_pas > 0
+    e_pas[active] = pointers.gather(pointers.v)[active] + total[active] / g_pas[active]
+
+    for iteration in range(1, max_iter + 1):
+        pointers.scatter(pointers.e_pas, e_pas)
+        _settle(v_rest, settle, dt)
+        v = pointers.gather(pointers.v)
+        error = v - v_rest
+        max_error = np.abs(error[active]).max(initial=0)
+        if max_error <= tol:
+            break
+        e_pas[active] -= error[active]
+    return {"e_pas": e_pas, "v": v, "iterations": iteration, "max_error": max_error, "converged": max_error <= tol}
+
+
+def cell_segments(cell):
+    """The segments balance() works on: every segment of the sections with pas."""
+    return _Pointers(cell).segments
+
+
+def save_profile(path, cell, v_rest):
+    """Write the cell's e_pas per segment, with its morphology and discretization, to a JSON file."""
+    sections = {}
+    for seg in cell_segments(cell):
+        sections.setdefault(cell.section_names[seg.sec], []).append(seg.e_pas)
+    with open(path, "w") as f:
+        json.dump({"cell": model_fingerprint([cell])["cells"][0], "v_rest": v_rest, "e_pas": sections}, f, indent=1)
+
+
+def apply_profile(cell, path):
+    """Set e_pas of the cell from a profile saved by save_profile(); the cell must have the same morphology file
+    and discretization."""
+    with open(path) as f:
+        profile = json.load(f)
+    if profile["cell"] != model_fingerprint([cell])["cells"][0]:
+        raise ValueError(f"The e_pas profile '{path}' was made for another morphology or discretization of "
+                         f"{profile['cell']['cell_name']}")
+    pointers = _Pointers(cell)
+    values = [value for sec in cell.all if cell.section_names[sec] in profile["e_pas"]
+              for value in profile["e_pas"][cell.section_names[sec]]]
+    if len(values) != len(pointers.segments):
+        raise ValueError(f"The e_pas profile '{path}' has {len(values)} segments, the cell {len(pointers.segments)}")
+    pointers.scatter(pointers.e_pas, values)
+    return profile["v_rest"]
@@ -0,0 +1,123 @@
+""" Binary cache of parsed Neurolucida morphologies.
+
+Parsing the .asc reconstructions with Import3d is a large fixed cost per process. The first time a file is loaded,
+the instantiated section tree (section names, parent links, connection points and 3D points with diameters) is
+written to a compact .npz file keyed on the SHA-1 of the .asc file. Later runs rebuild the sections directly from
+that file, without Import3d. """
+
+import hashlib
+import os
+
+import numpy as np
+from neuron import h
+
+CACHE_VERSION = 1
+CACHE_DIR_NAME = ".morph_cache"  # created next to the morphology file unless a cache_dir is given
+
+
+def file_hash(path):
+    """SHA-1 hex digest of a file's contents."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cache_path(morphology_path, cache_dir=None):
+    """Location of the cache file for a morphology (the name contains the file hash, so edits invalidate it)."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(morphology_path)), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(morphology_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{file_hash(morphology_path)[:16]}.npz")
+
+
+def snapshot_sections(sections):
+    """Collect the section tree in arrays: names, parent index, connection points and 3D points (x, y, z, diam)."""
+    sections = list(sections)
+    index = {sec: i for i, sec in enumerate(sections)}
+
+    names = []
+    parent = np.full(len(sections), -1, dtype=np.int32)
+    parent_x = np.zeros(len(sections))
+    child_x = np.zeros(len(sections))
+    pt_offset = np.zeros(len(sections) + 1, dtype=np.int64)
+    points = []
+
+    for i, sec in enumerate(sections):
+        names.append(sec.name().split('.')[-1])
+        pseg = sec.parentseg()
+        if pseg is not None:
+            parent[i] = index[pseg.sec]
+            parent_x[i] = pseg.x
+            child_x[i] = sec.orientation()
+        n3d = sec.n3d()
+        pts = np.empty((n3d, 4), dtype=np.float32)  # NEURON stores 3D points in single precision
+        for j in range(n3d):
+            pts[j] = (sec.x3d(j), sec.y3d(j), sec.z3d(j), sec.diam3d(j))
+        points.append(pts)
+        pt_offset[i + 1] = pt_offset[i] + n3d
+
+    return {
+        "version": np.int32(CACHE_VERSION),
+        "names": np.array(names),
+        "parent": parent,
+        "parent_x": parent_x,
+        "child_x": child_x,
+        "pt_offset": pt_offset,
+        "points": np.concatenate(points) if points else np.empty((0, 4), dtype=np.float32),
+    }
+
+
+def save(path, data):
+    """Write a snapshot to disk (atomically, so parallel processes never read a partial file)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **data)
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """Read a snapshot from disk, or return None if it is missing or was written by another cache version."""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as npz:
+        data = {key: npz[key] for key in npz.files}
+    if int(data["version"]) != CACHE_VERSION:
+        return None
+    return data
+
+
+def build_sections(cell, data):
+    """Recreate the section tree of a snapshot on `cell`, the same way Import3d_GUI.instantiate does.
+
+    Sections are created in the original order and named after it (e.g. 'axon[3]'), are appended to cell.all and
+    are exposed as the lists cell.soma, cell.dend, cell.apic and cell.axon.
+    """
+    names = [str(name) for name in data["names"]]
+    sections = []
+    for name in names:
+        sec = h.Section(name=name, cell=cell)
+        sections.append(sec)
+
+    pt_offset = data["pt_offset"]
+    columns = [h.Vector(data["points"][:, k].astype(float)) for k in range(4)]  # x, y, z, diam
+    for i, sec in enumerate(sections):
+        first, last = int(pt_offset[i]), int(pt_offset[i + 1]) - 1
+        if last >= first:
+            h.pt3dadd(*[column.c(first, last) for column in columns], sec=sec)
+
+    for i, sec in enumerate(sections):
+        if data["parent"][i] >= 0:
+            sec.connect(sections[data["parent"][i]](data["parent_x"][i]), data["child_x"][i])
+
+    by_type = {}
+    for name, sec in zip(names, sections):
+        cell.all.append(sec)
+        sec_type, index = name.rstrip(']').split('[')
+        by_type.setdefault(sec_type, {})[int(index)] = sec
+    for sec_type, secs in by_type.items():
+        setattr(cell, sec_type, [secs[i] for i in sorted(secs)])
+
+    return sections
@@ -0,0 +1,101 @@
+""" Run independent simulation jobs in parallel.
+
+A protocol is a pair of module-level functions: setup(*setup_args) builds the model once per process and returns
+its state (e.g. the cells), and job_fn(state, job) runs one job (an amplitude, a seed, ...) on that state and
+returns a small result. Jobs must not depend on each other, so the results are the same whether they run serially
+or spread over worker processes, and are returned in the order of the jobs.
+
+run_jobs() picks the backend: 'serial', 'pool' (worker processes on this machine) or 'mpi' (NEURON's bulletin board
+over MPI ranks). By default a script started with `mpiexec -n N python script.py` uses MPI and otherwise a pool. """
+
+import atexit
+import multiprocessing
+import os
+
+from neuron import h
+
+backends = ('serial', 'pool', 'mpi')
+_mpi_environment = ('OMPI_COMM_WORLD_SIZE', 'PMI_SIZE', 'PMIX_RANK', 'MPI_LOCALNRANKS')  # set by mpiexec
+
+_state = None  # the setup() result of this worker process
+_pc = None
+_mpi_exit = []  # whether _finalize_mpi is registered (and then whether it ran)
+
+
+def _init_worker(setup, setup_args):
+    global _state
+    _state = setup(*setup_args)
+
+
+def _run_job(job_fn, job):
+    return job_fn(_state, job)
+
+
+def run_serial(setup, job_fn, jobs, setup_args=()):
+    state = setup(*setup_args)
+    return [job_fn(state, job) for job in jobs]
+
+
+def run_pool(setup, job_fn, jobs, n_workers=None, setup_args=()):
+    """Run jobs on a pool of worker processes that each call setup() once and then take jobs from a queue."""
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    n_workers = min(n_workers or os.cpu_count(), len(jobs))
+    # Start fresh interpreters rather than forking, NEURON's state is not safe to share with a forked child
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(n_workers, initializer=_init_worker, initargs=(setup, setup_args)) as pool:
+        return pool.starmap(_run_job, [(job_fn, job) for job in jobs], chunksize=1)
+
+
+def _finalize_mpi():
+    if len(_mpi_exit) == 1:  # h.quit() exits Python, which runs the exit handlers again
+        _mpi_exit.append(True)
+        h.quit()
+
+
+def _parallel_context():
+    global _pc
+    if _pc is None:
+        h.nrnmpi_init()  # must come before the ParallelContext is created
+        _pc = h.ParallelContext()
+    return _pc
+
+
+def run_mpi(setup, job_fn, jobs, setup_args=()):
+    """Run jobs on the ParallelContext bulletin board. Every rank calls setup() once; rank 0 submits the jobs and
+    collects the results while the other ranks execute jobs, and exit when rank 0 is done. Only rank 0 returns.
+    Without MPI (one rank) the jobs run serially."""
+    jobs = list(jobs)
+    pc = _parallel_context()
+    if jobs:
+        _init_worker(setup, setup_args)
+    pc.runworker()  # ranks other than 0 stay in here
+
+    results = [None] * len(jobs)
+    for i, job in enumerate(jobs):
+        pc.submit(i, _run_job, job_fn, job)
+    while pc.working():
+        results[int(pc.userid())] = pc.pyret()
+    pc.done()
+    if pc.nhost() > 1 and not _mpi_exit:
+        _mpi_exit.append(True)
+        atexit.register(_finalize_mpi)  # the other ranks have quit, rank 0 finalizes MPI when the script ends
+    return results
+
+
+def default_backend():
+    return 'mpi' if any(name in os.environ for name in _mpi_environment) else 'pool'
+
+
+def run_jobs(setup, job_fn, jobs, backend=None, n_workers=None, setup_args=()):
+    """Run jobs with the given backend (default: default_backend()). n_workers only applies to the pool; under MPI
+    the number of ranks is set by mpiexec."""
+    backend = backend or default_backend()
+    if backend == 'serial':
+        return run_serial(setup, job_fn, jobs, setup_args)
+    if backend == 'pool':
+        return run_pool(setup, job_fn, jobs, n_workers, setup_args)
+    if backend == 'mpi':
+        return run_mpi(setup, job_fn, jobs, setup_args)
+    raise ValueError(f"Unknown backend '{backend}'. Available: {', '.join(backends)}")
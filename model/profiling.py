@@ -0,0 +1,163 @@
+""" Where the simulation time goes: wall time per simulated ms broken down by mechanism and by region.
+
+NEURON has no per-mechanism timers in a standard build, so the costs are measured by ablation at a fixed dt:
+
+- density mechanisms (the Markov sodium channels, Kv1, Kv7, ih, pas, ...): the model is rebuilt and run with the
+  mechanism removed everywhere (sec.uninsert); its cost is the difference to the full model.
+- regions (soma, dend, apic, ais, hillock, axon, boutons of each cell): rebuilt and run with all mechanisms except pas
+  removed from the region's sections; what remains of the region is the cable (estimated from its share of segments).
+- point processes (Gfluct2, IClamp, synapses): their marginal cost, from runs with `extra` more instances at the
+  same locations, times the number of instances.
+
+The electrical behaviour of an ablated model is different, but with a fixed time step the work per step does not
+depend on it. Every ablated run is paired with a run of the full model (built anew as well), `repeats` times, and the
+fastest runs of both are compared, so that drifts in machine speed during the profile do not enter the costs. """
+
+import gc
+import time
+
+from neuron import h
+
+_not_ablated = ("pas",)  # kept in region ablations so that the region stays a passive cable
+
+
+def density_mechanisms():
+    """Names of the density mechanisms inserted anywhere (ion mechanisms excluded), with their number of segments."""
+    counts = {}
+    for sec in h.allsec():
+        for mech in sec(0.5):
+            name = mech.name()
+            if not name.endswith("_ion"):
+                counts[name] = counts.get(name, 0) + sec.nseg
+    return counts
+
+
+def point_processes():
+    """Number of instances of each point process type (IClamp, Gfluct2, synapses, ...)."""
+    mechanism_types = h.MechanismType(1)
+    name = h.ref("")
+    counts = {}
+    for i in range(int(mechanism_types.count())):
+        mechanism_types.select(i)
+        mechanism_types.selected(name)
+        n = int(h.List(name[0]).count())
+        if n:
+            counts[name[0]] = n
+    return counts
+
+
+def time_run(tstop, dt, v_init):
+    """Wall time (s) of a run from finitialize(v_init) to tstop at a fixed dt."""
+    h.cvode_active(0)
+    h.dt = dt
+    h.finitialize(v_init)
+    h.fadvance()  # the first step after building also sets up the solver, keep it out of the timing
+    h.finitialize(v_init)
+    start = time.perf_counter()
+    h.continuerun(tstop)
+    return time.perf_counter() - start
+
+
+def _measure(build, ablate, tstop, dt, v_init):
+    """Build the model, apply ablate(model) (if given) and time a run; the model is freed before returning."""
+    model = build()
+    if ablate is not None:
+        ablate(model)
+    wall = time_run(tstop, dt, v_init)
+    del model
+    gc.collect()  # free the sections before the next build
+    return wall
+
+
+def _paired(build, ablate, tstop, dt, v_init, repeats):
+    """Fastest wall times (s) of the full and of the ablated model, from `repeats` interleaved runs of each."""
+    full, ablated = [], []
+    for _ in range(repeats):
+        full.append(_measure(build, None, tstop, dt, v_init))
+        ablated.append(_measure(build, ablate, tstop, dt, v_init))
+    return min(full), min(ablated)
+
+
+def _uninsert(mech_name):
+    def ablate(model):
+        for sec in h.allsec():
+            if h.ismembrane(mech_name, sec=sec):
+                sec.uninsert(mech_name)
+    return ablate
+
+
+def _strip_region(cell_name, region):
+    def ablate(model):
+        for sec in model["cells"][cell_name].regions[region]:
+            for mech in [mech.name() for mech in sec(0.5)]:
+                if not mech.endswith("_ion") and mech not in _not_ablated:
+                    sec.uninsert(mech)
+    return ablate
+
+
+def _add_point_processes(name, extra):
+    def ablate(model):
+        existing = list(h.List(name))
+        model.setdefault("extra", [])
+        for k in range(extra):
+            model["extra"].append(getattr(h, name)(existing[k % len(existing)].get_segment()))
+    return ablate
+
+
+def profile(build, tstop=20, dt=0.025, v_init=-90, celsius=34, repeats=3, extra=10):
+    """Break the wall time of a run of the model made by build() down by mechanism and region.
+
+    build() must build the whole model from scratch (cells with channels, stimuli, noise, ...) and return a dict
+    with the Cell objects under 'cells' ({cell_name: Cell}) and everything else that must stay alive. Returns a dict
+    with the baseline and rows per mechanism and per region; times are wall ms per simulated ms."""
+    h.celsius = celsius
+
+    def per_ms(wall):
+        return 1000 * wall / tstop
+
+    model = build()
+    mechanisms = density_mechanisms()
+    processes = point_processes()
+    regions = [(cell_name, region, sum(sec.nseg for sec in sections))
+               for cell_name, cell in model["cells"].items() for region, sections in cell.regions.items() if sections]
+    nseg = sum(sec.nseg for sec in h.allsec())
+    del model
+    gc.collect()
+
+    baselines = []
+
+    def cost(ablate):
+        """Wall ms per simulated ms saved by ablate(), relative to the full model."""
+        full, ablated = _paired(build, ablate, tstop, dt, v_init, repeats)
+        baselines.append(per_ms(full))
+        return per_ms(full) - per_ms(ablated)
+
+    mechanism_rows = []
+    for name, segments in mechanisms.items():
+        mechanism_rows.append({"mechanism": name, "kind": "density", "instances": segments,
+                               "ms_per_ms": cost(_uninsert(name))})
+    for name, n in processes.items():
+        mechanism_rows.append({"mechanism": name, "kind": "point process", "instances": n,
+                               "ms_per_ms": -cost(_add_point_processes(name, extra)) / extra * n})
+    region_costs = [cost(_strip_region(cell_name, region)) for cell_name, region, _ in regions]
+
+    baseline = min(baselines)
+    for row in mechanism_rows:
+        row["share"] = row["ms_per_ms"] / baseline
+
+    # What the mechanisms do not explain (matrix solve, cable, ions, run overhead), spread by segment count
+    cable_per_segment = (baseline - sum(row["ms_per_ms"] for row in mechanism_rows)) / nseg
+    region_rows = []
+    for (cell_name, region, segments), channels in zip(regions, region_costs):
+        cable = cable_per_segment * segments
+        region_rows.append({"cell": cell_name, "region": region, "nseg": segments, "channels_ms_per_ms": channels,
+                            "cable_ms_per_ms": cable, "share": (channels + cable) / baseline})
+
+    return {
+        "baseline_ms_per_ms": baseline,
+        "baseline_spread_ms_per_ms": max(baselines) - baseline,  # costs smaller than this are within the noise
+        "nseg": nseg,
+        "settings": {"tstop": tstop, "dt": dt, "v_init": v_init, "celsius": celsius, "repeats": repeats},
+        "mechanisms": sorted(mechanism_rows, key=lambda row: -row["ms_per_ms"]),
+        "regions": sorted(region_rows, key=lambda row: -row["share"]),
+    }
@@ -0,0 +1,182 @@
+""" Declarative protocols: run the protocols described in a JSON or YAML file, headless and in batch.
+
+A protocol file names the morphologies (paths relative to the repository), default run parameters and a list of
+protocols, e.g.
+
+    {
+      "morphologies": {"chc": "morphologies/L23ChC-j140718b_ar_boutons.asc",
+                       "pyr": "morphologies/L23pyr-j150802c_ar.asc"},
+      "defaults": {"dt": 0.05, "celsius": 34, "v_init": -90, "thresh": -20},
+      "protocols": [
+        {"name": "if_curve", "type": "step_current", "cells": ["chc", "pyr"],
+         "delay": 100, "dur": 500, "tstop": 700, "sweep": {"amp": {"start": 0, "stop": 2, "step": 0.1}}}
+      ]
+    }
+
+The type selects the setup and job functions (see protocol_types). The job dict of a protocol is the defaults
+updated with the protocol's own entries; "sweep" gives lists of values (or an inclusive start/stop/step range) and
+one job is run per combination, and for per-cell types per cell in "cells" (default: all morphologies). Other
+top-level entries of a protocol (name, type, cells, sweep, network, cell_parameters) are not part of the job.
+"cell_parameters" gives parameters per cell, e.g. {"chc": {"amp": 0.3}, "pyr": {"amp": 0.6}}, and "network" the
+synapse_module, syn_e and stim_chc arguments of protocols.build_noise_network.
+
+All jobs of all protocols go to a single parallel.run_jobs call (so that MPI ranks are only started once); each
+worker builds the cells of a protocol when it gets the first job of that protocol. Results are cached in the
+result cache and returned per protocol as a list of records, one per job, that hold the swept values and the
+results. """
+
+import gc
+import importlib.util
+import itertools
+import json
+import os
+
+import numpy as np
+
+import protocols
+from current_search import find_current
+from morphology_cache import file_hash
+from parallel import run_jobs
+from result_cache import ResultCache, cell_spec, repo_dir
+
+# type: (setup function, job function, whether there is one job per cell)
+protocol_types = {
+    "step_current": (protocols.build_cells, protocols.step_current, True),
+    "current_search": (protocols.build_cells, find_current, True),
+    "single_ap": (protocols.build_cells, protocols.single_ap, True),
+    "membrane_tau": (protocols.build_cells, protocols.membrane_tau, True),
+    "membrane_tau_batch": (protocols.build_cell_batch, protocols.membrane_tau_batch, False),
+    "input_resistance": (protocols.build_cells, protocols.input_resistance, True),
+    "impedance": (protocols.build_cells, protocols.impedance_profile, True),
+    "bouton_propagation": (protocols.build_cells, protocols.bouton_propagation, True),
+    "noise": (protocols.build_noise_network, protocols.noise_trial, False),
+}
+_not_job = ("name", "type", "cells", "sweep", "network", "cell_parameters")
+
+
+def load(path):
+    """Read a protocol file (.json, or .yaml / .yml if PyYAML is installed)."""
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def resolve_path(path):
+    """Paths in protocol files are relative to the repository."""
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(repo_dir, path))
+
+
+def _values(values):
+    """Sweep values: a list, or {'start', 'stop', 'step'} for an inclusive range."""
+    if not isinstance(values, dict):
+        return list(values)
+    start, stop, step = values["start"], values["stop"], values["step"]
+    if all(isinstance(value, int) for value in (start, stop, step)):
+        return list(range(start, stop + 1, step))
+    return [round(value, 12) for value in np.arange(start, stop + step / 2, step).tolist()]
+
+
+class Protocol:
+    def __init__(self, spec, morphologies, defaults):
+        if spec.get("type") not in protocol_types:
+            raise ValueError(f"Protocol '{spec.get('name')}': unknown type '{spec.get('type')}'. "
+                             f"Available: {', '.join(protocol_types)}")
+        self.name = spec.get("name", spec["type"])
+        self.setup, self.job_fn, self.per_cell = protocol_types[spec["type"]]
+        self.cells = spec.get("cells", list(morphologies))
+        self.morphologies = {cell_name: resolve_path(morphologies[cell_name]) for cell_name in self.cells}
+        self.network = spec.get("network", {})
+        self.cell_parameters = spec.get("cell_parameters", {})
+        self.sweep = {name: _values(values) for name, values in spec.get("sweep", {}).items()}
+        self.parameters = {**defaults, **{name: value for name, value in spec.items() if name not in _not_job}}
+
+    def setup_args(self):
+        if self.setup is protocols.build_noise_network:
+            return (self.morphologies, self.network.get("synapse_module"), self.network.get("syn_e", -70),
+                    self.network.get("stim_chc"))
+        return (self.morphologies,)
+
+    def jobs(self):
+        combinations = [dict(zip(self.sweep, values)) for values in itertools.product(*self.sweep.values())]
+        if not self.per_cell:
+            return [{**self.parameters, **swept} for swept in combinations]
+        return [{**self.parameters, **self.cell_parameters.get(cell_name, {}), **swept, "cell": cell_name}
+                for swept in combinations for cell_name in self.cells]
+
+    def cache_key(self, cache, job):
+        """Result cache key: the cells this protocol builds, the job and the synapse file of a network."""
+        network = dict(self.network)
+        if network.get("synapse_module"):
+            network["synapses"] = file_hash(importlib.util.find_spec(network["synapse_module"]).origin)
+        cells = [cell_spec(cell_name, path) for cell_name, path in self.morphologies.items()]
+        return cache.key(cells, {**job, "protocol": self.name, "network": network})
+
+
+def setup_protocols(setups):
+    """Setup for run_protocol_job(): [(setup, setup_args)] per protocol; the model of a protocol is built on use."""
+    return {"setups": setups, "current": None, "state": None}
+
+
+def run_protocol_job(state, item):
+    """Job function for a (protocol index, job, job_fn) item: builds the protocol's model in place of the previous
+    one if needed and runs the job on it."""
+    index, job, job_fn = item
+    if state["current"] != index:
+        state["current"], state["state"] = None, None
+        gc.collect()  # delete the sections of the previous protocol's cells before building the next
+        setup, setup_args = state["setups"][index]
+        state["state"] = setup(*setup_args)
+        state["current"] = index
+    return job_fn(state["state"], job)
+
+
+def run(config, names=None, backend=None, n_workers=None, use_cache=True):
+    """Run the protocols of a loaded protocol file (only those in names, if given); returns {name: [record]}."""
+    morphologies = config["morphologies"]
+    defaults = config.get("defaults", {})
+    selected = [Protocol(spec, morphologies, defaults) for spec in config["protocols"]
+                if names is None or spec.get("name", spec["type"]) in names]
+
+    items = [(index, job, protocol.job_fn) for index, protocol in enumerate(selected) for job in protocol.jobs()]
+    setups = [(protocol.setup, protocol.setup_args()) for protocol in selected]
+
+    def run_missing(missing):
+        return run_jobs(setup_protocols, run_protocol_job, [items[i] for i in missing], backend, n_workers,
+                        setup_args=(setups,))
+
+    if use_cache:
+        cache = ResultCache()
+        keys = [selected[index].cache_key(cache, job) for index, job, _ in items]
+        results = cache.cached_batch(keys, run_missing)
+    else:
+        results = run_missing(list(range(len(items))))
+
+    records = {protocol.name: [] for protocol in selected}
+    for (index, job, _), result in zip(items, results):
+        protocol = selected[index]
+        swept = {name: job[name] for name in [*(("cell",) if protocol.per_cell else ()), *protocol.sweep]}
+        records[protocol.name].append({**swept, **result})
+    return records
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def save(records, output_dir, config=None):
+    """Write one <protocol name>.json file per protocol, with its records (and its definition from config)."""
+    os.makedirs(output_dir, exist_ok=True)
+    specs = {spec.get("name", spec["type"]): spec for spec in (config or {}).get("protocols", [])}
+    paths = []
+    for name, protocol_records in records.items():
+        path = os.path.join(output_dir, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump({"protocol": specs.get(name), "results": protocol_records}, f, indent=1, default=_to_json)
+        paths.append(path)
+    return paths
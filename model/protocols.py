@@ -0,0 +1,436 @@
+""" Simulation protocols shared by the tools and experiments, written as setup and job functions for parallel.py.
+
+The setup function builds the cells once; each job function sets the simulation parameters and its own stimuli
+from the job dict, runs, and returns a dict of numbers and arrays (so results can also go into result_cache). """
+
+import importlib
+
+import numpy as np
+from neuron import h
+
+import conduction
+import features
+import impedance
+import recording
+from cells_def import Cell
+from state_store import StateStore
+
+_state_store = None  # created by the first run with job['settle']
+
+
+def build_cells(morphologies, discretizations=None, channels=True):
+    """Build each cell of {cell_name: morphology path} with all channels, in the order the tools add them.
+    Cells are built in dict order, as in the original scripts.
+    discretizations: optional {cell_name: discretization policy} (default: the reference mesh);
+    channels=False builds passive cells."""
+    discretizations = discretizations or {}
+    cells = {}
+    for cell_name, morphology_path in morphologies.items():
+        cell = Cell(morphology_path, cell_name, discretization=discretizations.get(cell_name))
+        if channels:
+            cell.add_sodium_channels()
+            cell.add_potassium_channels()
+            cell.add_ih_channels()
+        cells[cell_name] = cell
+    return cells
+
+
+def set_run_parameters(job):
+    h.tstop = job["tstop"]
+    h.dt = job["dt"]
+    h.celsius = job["celsius"]
+    h.v_init = job["v_init"]
+
+
+def start_run(cells, job):
+    """Initialize a run the way h.run() does (h.stdinit(): dt is adjusted to steps_per_ms, then finitialize at
+    v_init). With job['settle'] (ms) the run then continues from a settled state at t = settle, see state_store.
+    Follow with h.continuerun(h.tstop). cells: the Cell objects in the simulation."""
+    global _state_store
+    if not job.get("settle"):
+        h.stdinit()
+        return
+    if _state_store is None:
+        _state_store = StateStore()
+    _state_store.initialize(list(cells), job["settle"])
+
+
+def step_current(cells, job):
+    """Count the spikes at the soma of job['cell'] for a current step of job['amp'] nA (I-F curves)."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+
+    stim = h.IClamp(cell.soma(0.5))
+    stim.delay = job["delay"]
+    stim.dur = job["dur"]
+    stim.amp = job["amp"]
+
+    ap_counter = h.APCount(cell.soma(0.5))
+    ap_counter.thresh = job["thresh"]  # Spike detection threshold
+
+    start_run(cells.values(), job)
+    h.continuerun(h.tstop)
+    return {"spike_count": int(ap_counter.n)}
+
+
+def single_ap(cells, job):
+    """Features of the first action potential (see features.ap_features) at the soma of job['cell'] for a brief
+    step of job['amp'] nA, as in tools/phase_plot.py, and the number of spikes. The AP onset is searched from
+    job['onset_window'] ms (default 2) before the first crossing of job['thresh']; without a spike the features are
+    NaN. dt_used is the time step after h.stdinit() adjusted job['dt'] (see start_run)."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+
+    stim = h.IClamp(cell.soma(0.5))
+    stim.delay = job["delay"]
+    stim.dur = job["dur"]
+    stim.amp = job["amp"]
+
+    v_vec = h.Vector().record(cell.soma(0.5)._ref_v)
+    start_run(cells.values(), job)
+    h.continuerun(h.tstop)
+
+    v = v_vec.as_numpy()
+    spikes = np.flatnonzero(features.crossings(v, job["thresh"])[0])
+    # Look for the AP onset shortly before the first spike: the start of the step also has a steep dV/dt
+    start = max(0, spikes[0] - int(round(job.get("onset_window", 2) / h.dt))) if len(spikes) else 0
+    ap = features.ap_features(v[start:], h.dt, job.get("dvdt_threshold", 20))
+    result = {name: value[0] if len(spikes) else np.nan for name, value in ap.items()}
+    result["threshold_index"] = ap["threshold_index"][0] + start if len(spikes) else -1
+    result["spike_count"] = len(spikes)
+    result["dt_used"] = h.dt
+    return result
+
+
+def membrane_tau(cells, job):
+    """Membrane time constant of job['cell']: single exponential fitted to the soma voltage over job['fit_window']
+    ms after the end of a (hyperpolarizing) step of job['amp'] nA, as in tools/tau_calc.py. Also returns the input
+    resistance from the steady-state deflection at the end of the step."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+
+    stim = h.IClamp(cell.soma(0.5))
+    stim.delay = job["delay"]
+    stim.dur = job["dur"]
+    stim.amp = job["amp"]
+
+    t_vec = h.Vector().record(h._ref_t)
+    v_vec = h.Vector().record(cell.soma(0.5)._ref_v)
+    start_run(cells.values(), job)
+    h.continuerun(h.tstop)
+
+    t, v = t_vec.as_numpy(), v_vec.as_numpy()
+    offset = job["delay"] + job["dur"]
+    fit = features.fit_tau(t, v, offset, offset + job["fit_window"])
+    v_rest = v[np.searchsorted(t, job["delay"]) - 1]
+    v_step = v[np.searchsorted(t, offset) - 1]
+    return {
+        "tau": fit["tau"][0],
+        "V0": fit["V0"][0],
+        "Vinf": fit["Vinf"][0],
+        "v_rest": v_rest,
+        "rin_step": (v_step - v_rest) / job["amp"],  # MOhm (mV / nA)
+    }
+
+
+def input_resistance(cells, job):
+    """Input resistance (MOhm) at the soma of job['cell'] from NEURON's Impedance tool at job['freq'] Hz (default 0,
+    DC), linearized around the state at t = job['settle'] (or at v_init), as in tools/Rn_calc.py."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+    start_run(cells.values(), job)
+
+    rin = impedance.compute([cell.soma(0.5)], job.get("freq", 0), cell.soma(0.5))["input"][0, 0]
+    return {"rin": rin, "v_soma": cell.soma(0.5).v}
+
+
+def impedance_profile(cells, job):
+    """Input and transfer impedance (see impedance.compute) at the locations job['sites'] of job['cell'] (e.g.
+    ['soma', 'axon[0](0.3)', 'dend[12](0.5)']) for each of job['frequencies'] (Hz), relative to job['reference']
+    (default 'soma'), linearized around the state at t = job['settle'] (or at v_init). Returns (frequencies x sites)
+    arrays and the frequencies."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+    start_run(cells.values(), job)
+
+    sites = [impedance.segment(cell, location) for location in job["sites"]]
+    reference = impedance.segment(cell, job.get("reference", "soma"))
+    return impedance.compute(sites, job["frequencies"], reference, job.get("extended", False))
+
+
+def bouton_propagation(cells, job):
+    """Propagation of a ChC action potential to its boutons: a step of job['amp'] nA at the soma of job['cell'],
+    with spike detectors (threshold job['thresh']) at the soma and at the sites of conduction.sites(cell,
+    job['sites']) ('cartridges' by default, 'boutons' or 'terminals'), or at the middle of the axon sections listed
+    per cartridge in job['cartridges']. Returns per site its cartridge, path distance from the soma (um), activation
+    time, delay after the soma spike (ms) and conduction velocity (m/s), NaN where the site did not spike, and the
+    means per cartridge (see conduction.analyze)."""
+    cell = cells[job["cell"]]
+    set_run_parameters(job)
+
+    stim = h.IClamp(cell.soma(0.5))
+    stim.delay = job["delay"]
+    stim.dur = job["dur"]
+    stim.amp = job["amp"]
+
+    if job.get("cartridges"):
+        segments = [cell.axon[i](0.5) for sections in job["cartridges"] for i in sections]
+        cartridge = np.repeat(np.arange(len(job["cartridges"])), [len(sections) for sections in job["cartridges"]])
+    else:
+        segments, cartridge = conduction.sites(cell, job.get("sites", "cartridges"))
+    first_times = conduction.record_activation([cell.soma(0.5)] + segments, job["thresh"])
+    start_run(cells.values(), job)
+    h.continuerun(h.tstop)
+
+    first = first_times()
+    return conduction.analyze(cell, segments, cartridge, first[1:], first[0])
+
+
+def build_noise_network(morphologies, synapse_module=None, syn_e=-70, stim_chc=None):
+    """Setup for noise_trial(): the cells of {cell_name: path} and, if a ChC is included, its boutons connected to
+    the pyramidal cell with connect_boutons() of synapse_module (e.g. 'synapse_general') and a current step
+    stim_chc = {'delay', 'dur', 'amp'} at the ChC soma."""
+    return _connect_network(build_cells(morphologies), synapse_module, syn_e, stim_chc)
+
+
+def _connect_network(cells, synapse_module, syn_e, stim_chc):
+    state = {"cells": cells}
+    if "chc" in cells and synapse_module:
+        connect_boutons = importlib.import_module(synapse_module).connect_boutons
+        synapses = connect_boutons(cells["chc"], cells["pyr"])
+        for syn in synapses:
+            syn.syn.e = syn_e  # Setting the reversal potential
+        state["synapses"] = synapses
+    if "chc" in cells and stim_chc:
+        stim = h.IClamp(cells["chc"].soma(0.5))
+        stim.delay = stim_chc["delay"]
+        stim.dur = stim_chc["dur"]
+        stim.amp = stim_chc["amp"]
+        state["stim_chc"] = stim
+    return state
+
+
+def noise_trial(state, job):
+    """One trial of fluctuating conductance noise (Gfluct2 with job['noise'] parameters and job['seed']) at the
+    pyramidal soma; returns its spike times and summary (see summarize_noise_trial).
+
+    With job['record'] = 'spikes' (also in noise_trial_batch) the soma voltage is not recorded every time step:
+    spikes are detected by a NetCon and the Vm statistics use samples every job['sample_dt'] ms (stored as float32).
+    The default, 'full', records every step."""
+    pyr = state["cells"]["pyr"]
+    set_run_parameters(job)
+
+    gfluct = h.Gfluct2(pyr.soma(0.5)) # refer to the Gfluct .mod file for publication details
+    for name, value in job["noise"].items():
+        setattr(gfluct, name, value)
+    gfluct.new_seed(job["seed"])
+
+    summarize = _soma_recording(pyr, job)
+    start_run(state["cells"].values(), job)
+    h.continuerun(h.tstop)
+    return summarize()
+
+
+def _soma_recording(cell, job):
+    """Record at the soma as needed for summarize_noise_trial() in the mode job['record']; returns a function that
+    summarizes the recording after the run."""
+    if job.get("record", "full") == "spikes":
+        detectors, spike_vecs = recording.record_spikes([cell.soma(0.5)], job["thresh"])
+        v_vec, t_vec = recording.record_sampled(cell.soma(0.5)._ref_v, job["sample_dt"])
+
+        def summarize():
+            # The NetCon reports the first step at or above threshold, one step after the sample used in full mode
+            spike_times = spike_vecs[0].as_numpy() - h.dt
+            t, v = recording.as_array([t_vec, v_vec])
+            return summarize_noise_trial(t, v, job, spike_times)
+        summarize.detectors = detectors  # keep the NetCon alive until the run is over
+        return summarize
+
+    t_vec = h.Vector().record(h._ref_t)
+    v_vec = h.Vector().record(cell.soma(0.5)._ref_v)
+    return lambda: summarize_noise_trial(np.array(t_vec), np.array(v_vec), job)
+
+
+def build_noise_network_batch(morphologies, synapse_module=None, syn_e=-70, stim_chc=None, batch_size=1):
+    """Setup for noise_trial_batch(): build_noise_network() plus batch_size - 1 unconnected copies of the network
+    (cloned cells with their own synapses and ChC step)."""
+    first = build_noise_network(morphologies, synapse_module, syn_e, stim_chc)
+    clones = {cell_name: cell.clones(batch_size - 1) for cell_name, cell in first["cells"].items()}
+    instances = [first]
+    for k in range(batch_size - 1):
+        cells = {cell_name: clones[cell_name][k] for cell_name in first["cells"]}
+        instances.append(_connect_network(cells, synapse_module, syn_e, stim_chc))
+    return {"instances": instances}
+
+
+def noise_trial_batch(state, job):
+    """job['batch_size'] (default: all) noise trials integrated together in one run, one per network instance;
+    returns their summaries stacked (see stack_results).
+
+    Gfluct2 draws from NEURON's global normrand stream (see Gfluct.mod), so all instances share one stream that is
+    seeded once with job['seed']. A batch is reproducible, but its trials differ from single trials run with
+    noise_trial() and seeds job['seed'], job['seed'] + 1, ..."""
+    instances = state["instances"][:job.get("batch_size", len(state["instances"]))]
+    set_run_parameters(job)
+
+    gflucts = []
+    summaries = []
+    for instance in instances:
+        pyr = instance["cells"]["pyr"]
+        gfluct = h.Gfluct2(pyr.soma(0.5))
+        for name, value in job["noise"].items():
+            setattr(gfluct, name, value)
+        gflucts.append(gfluct)
+        summaries.append(_soma_recording(pyr, job))
+    gflucts[0].new_seed(job["seed"])  # seeds the shared stream
+
+    start_run([cell for instance in instances for cell in instance["cells"].values()], job)
+    h.continuerun(h.tstop)
+    return stack_results([summarize() for summarize in summaries])
+
+
+def build_cell_batch(morphologies, channels=True):
+    """Setup for step_current_batch() and membrane_tau_batch(): snapshots of the cells of build_cells(). Each job of
+    step_current_batch() runs a batch of copies of one cell type made from them, so the other cell types are not
+    simulated along."""
+    cells = build_cells(morphologies, channels=channels)
+    return {"snapshots": {cell_name: cell.snapshot() for cell_name, cell in cells.items()}, "batch": (None, [])}
+
+
+def _cell_batch(state, cell_name, batch_size):
+    """batch_size copies of a cell, reusing those of the previous job when possible."""
+    batch_cell, instances = state["batch"]
+    if batch_cell != cell_name or len(instances) != batch_size:
+        state["batch"] = (None, [])  # free the previous batch first
+        snapshot = state["snapshots"][cell_name]
+        state["batch"] = (cell_name, [Cell.from_snapshot(snapshot) for _ in range(batch_size)])
+    return state["batch"][1]
+
+
+def step_current_batch(state, job):
+    """step_current() for all amplitudes of job['amps'] in one run, one copy of job['cell'] per amplitude. The
+    copies are independent, so the spike counts are the same as from separate runs."""
+    instances = _cell_batch(state, job["cell"], len(job["amps"]))
+    set_run_parameters(job)
+
+    stims = []
+    ap_counters = []
+    for cell, amp in zip(instances, job["amps"]):
+        stim = h.IClamp(cell.soma(0.5))
+        stim.delay = job["delay"]
+        stim.dur = job["dur"]
+        stim.amp = amp
+        stims.append(stim)
+
+        ap_counter = h.APCount(cell.soma(0.5))
+        ap_counter.thresh = job["thresh"]  # Spike detection threshold
+        ap_counters.append(ap_counter)
+
+    start_run(instances, job)
+    h.continuerun(h.tstop)
+    return stack_results([{"spike_count": int(ap_counter.n)} for ap_counter in ap_counters])
+
+
+def membrane_tau_batch(state, job):
+    """membrane_tau() for every cell of the setup (build_cell_batch) and every amplitude of job['amps'] (nA,
+    hyperpolarizing) in one run, one copy of a cell per (cell, amplitude). The soma voltages are fitted all at once
+    over job['fit_window'] ms after the step: a single exponential (features.fit_tau) and the sum of job['n_exp']
+    (default 2) exponentials by peeling (features.peel_exponentials). Returns arrays per condition, in the order
+    cell, amp."""
+    conditions = [(cell_name, amp) for cell_name in state["snapshots"] for amp in job["amps"]]
+    if state["batch"][0] != ("membrane_tau", len(conditions)):  # otherwise reuse the copies of the previous job
+        state["batch"] = (None, [])  # free the previous batch first
+        state["batch"] = (("membrane_tau", len(conditions)),
+                          [Cell.from_snapshot(state["snapshots"][cell_name]) for cell_name, _ in conditions])
+    instances = state["batch"][1]
+    set_run_parameters(job)
+
+    stims, v_vecs = [], []
+    for cell, (_, amp) in zip(instances, conditions):
+        stim = h.IClamp(cell.soma(0.5))
+        stim.delay = job["delay"]
+        stim.dur = job["dur"]
+        stim.amp = amp
+        stims.append(stim)
+        v_vecs.append(h.Vector().record(cell.soma(0.5)._ref_v))
+    t_vec = h.Vector().record(h._ref_t)
+    start_run(instances, job)
+    h.continuerun(h.tstop)
+
+    t, v = t_vec.as_numpy(), recording.as_array(v_vecs, dtype=float)
+    offset = job["delay"] + job["dur"]
+    single = features.fit_tau(t, v, offset, offset + job["fit_window"])
+    peeled = features.peel_exponentials(t, v, offset, offset + job["fit_window"], job.get("n_exp", 2))
+    amps = np.array([amp for _, amp in conditions])
+    v_rest = v[:, np.searchsorted(t, job["delay"]) - 1]
+    v_step = v[:, np.searchsorted(t, offset) - 1]
+    return {
+        "cell": np.array([cell_name for cell_name, _ in conditions]),
+        "amp": amps,
+        "tau": single["tau"],
+        "V0": single["V0"],
+        "Vinf": single["Vinf"],
+        "rmse": single["rmse"],
+        "r2": single["r2"],
+        "taus": peeled["tau"],
+        "amplitudes": peeled["amplitude"],
+        "Vinf_peeled": peeled["Vinf"],
+        "rmse_peeled": peeled["rmse"],
+        "r2_peeled": peeled["r2"],
+        "n_components": peeled["n_components"],
+        "v_rest": v_rest,
+        "rin_step": (v_step - v_rest) / amps,  # MOhm (mV / nA)
+    }
+
+
+def stack_results(results):
+    """Combine the result dicts of a batch into one dict of arrays: numbers are stacked, arrays are concatenated
+    with their start offsets stored under '<name>_offsets'."""
+    stacked = {}
+    for name in results[0]:
+        values = [result[name] for result in results]
+        if np.ndim(values[0]) == 0:
+            stacked[name] = np.array(values)
+        else:
+            stacked[name] = np.concatenate(values)
+            stacked[f"{name}_offsets"] = np.cumsum([0] + [len(value) for value in values])
+    return stacked
+
+
+def unstack_results(stacked):
+    """Split a stack_results() dict back into one result dict per batch instance."""
+    names = [name for name in stacked if not name.endswith("_offsets")]
+    n = len(stacked[names[0] + "_offsets"]) - 1 if names[0] + "_offsets" in stacked else len(stacked[names[0]])
+    results = [{} for _ in range(n)]
+    for name in names:
+        offsets = stacked.get(f"{name}_offsets")
+        for k, result in enumerate(results):
+            result[name] = stacked[name][offsets[k]:offsets[k + 1]] if offsets is not None else stacked[name][k]
+    return results
+
+
+def summarize_noise_trial(t, v, job, spike_times=None):
+    """Spike times (upward crossings of job['thresh'], unless given), ISIs, Vm mean/std after noise onset and the
+    spike frequency over the noise period."""
+    noise_start = job["noise"]["delay"]
+
+    # Spike detection
+    if spike_times is None:
+        _, spike_times = features.spike_times(t, v, job["thresh"])
+    isis = np.diff(spike_times) if len(spike_times) > 1 else np.array([])
+
+    # Vm after noise onset
+    vm_mean, vm_std = features.vm_stats(t, v, start=noise_start)
+
+    # Frequency
+    spike_count = np.sum((spike_times >= noise_start) & (spike_times <= job["count_until"]))
+    freq = spike_count / (job["noise_duration"] / 1000)
+
+    return {
+        "spike_times": spike_times,
+        "spike_count": spike_count,
+        "isi": isis,
+        "vm_mean": vm_mean[0],
+        "vm_std": vm_std[0],
+        "frequency_hz": freq,
+    }
@@ -0,0 +1,155 @@
+""" Recording helpers: spike times only, sampled or windowed voltage, and streaming to disk for long simulations.
+
+record_spikes() keeps only threshold crossings (NetCon detectors), so memory and analysis scale with the number of
+spikes instead of tstop / dt; record_spike_raster() does the same for many sites into two shared vectors.
+record_sampled() records every sample_dt ms, optionally only within a time window. as_array() stacks recordings into
+a 2-D array, in float32 by default. BulkRecorder records many variables every time step with one PtrVector, gathered
+after each step, instead of a Vector per variable.
+
+StreamRecorder runs the simulation in chunks of `chunk` ms (h.continuerun). After each chunk the recorded samples
+are appended to a .npy file and the recording vectors are emptied, so memory use does not grow with tstop. The file
+holds one row per sample and one column per variable (time first); load() opens it memory-mapped. """
+
+import json
+import os
+
+import numpy as np
+from neuron import h
+from numpy.lib import format as npy_format
+
+
+def record_spikes(segments, threshold=-20):
+    """Spike times at each segment: upward crossings of threshold (mV), detected by a NetCon each time step.
+    Returns (detectors, [Vector of spike times per segment]); keep the detectors for as long as you record."""
+    detectors = []
+    spike_times = []
+    for seg in segments:
+        detector = h.NetCon(seg._ref_v, None, sec=seg.sec)
+        detector.threshold = threshold
+        times = h.Vector()
+        detector.record(times)
+        detectors.append(detector)
+        spike_times.append(times)
+    return detectors, spike_times
+
+
+def record_spike_raster(segments, threshold=-20):
+    """Spike times at many segments in two shared Vectors: like record_spikes(), but every detector records into the
+    same times Vector with its index into segments in the ids Vector, so the cost does not grow with a Vector per
+    segment. Returns (detectors, times, ids)."""
+    times, ids = h.Vector(), h.Vector()
+    detectors = []
+    for i, seg in enumerate(segments):
+        detector = h.NetCon(seg._ref_v, None, sec=seg.sec)
+        detector.threshold = threshold
+        detector.record(times, ids, i)
+        detectors.append(detector)
+    return detectors, times, ids
+
+
+def record_sampled(pointer, sample_dt, window=None):
+    """Record a variable every sample_dt ms, or only at the sample times within window = (start, stop).
+    Returns (Vector of values, Vector of sample times)."""
+    if window is None:
+        return h.Vector().record(pointer, sample_dt), h.Vector().record(h._ref_t, sample_dt)
+    start, stop = window
+    times = h.Vector(np.arange(start, stop + sample_dt / 2, sample_dt))
+    return h.Vector().record(pointer, times), times
+
+
+def as_array(vectors, dtype=np.float32):
+    """Stack equally long recordings into a (recordings x samples) array."""
+    return np.array([vec.as_numpy() for vec in vectors], dtype=dtype)
+
+
+class BulkRecorder:
+    def __init__(self, pointers, dtype=np.float64):
+        """pointers: the variables to record, e.g. [seg._ref_v for seg in segments]. All of them are gathered at
+        once after finitialize and after every time step. Call remove() when done: CVode keeps the recorder alive."""
+        self.pointers = h.PtrVector(len(pointers))
+        for i, pointer in enumerate(pointers):
+            self.pointers.pset(i, pointer)
+        self.dtype = np.dtype(dtype)
+        self._values = h.Vector(len(pointers))
+        self._samples = []
+        self._initialize = h.FInitializeHandler(1, self._restart)
+        self._cvode = h.CVode()
+        self._cvode.extra_scatter_gather(0, self._gather)
+
+    def _restart(self):
+        self._samples = []
+        self._gather()
+
+    def _gather(self):
+        self.pointers.gather(self._values)
+        self._samples.append(self._values.as_numpy().astype(self.dtype))
+
+    def as_array(self):
+        """The recording as a (variables x samples) array, aligned with h.Vector().record(h._ref_t)."""
+        return np.array(self._samples, dtype=self.dtype).reshape(-1, len(self._values)).T
+
+    def remove(self):
+        """Stop recording."""
+        self._cvode.extra_scatter_gather_remove(self._gather)
+        self._initialize = None
+
+
+class StreamRecorder:
+    def __init__(self, path, variables, sample_dt=None, chunk=100, dtype=np.float64):
+        """path: the .npy file to write; variables: {name: pointer}, e.g. {'soma': cell.soma(0.5)._ref_v};
+        sample_dt: sampling interval in ms (default: every time step)."""
+        self.path = path
+        self.names = ['t'] + list(variables)
+        self.sample_dt = sample_dt
+        self.chunk = chunk
+        self.dtype = np.dtype(dtype)
+        record_args = () if sample_dt is None else (sample_dt,)
+        self.vectors = [h.Vector().record(pointer, *record_args) for pointer in [h._ref_t, *variables.values()]]
+        self.n_samples = 0
+
+    def _header(self):
+        # numpy pads the header so that the number of rows can grow without changing its length
+        return {'descr': npy_format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                'shape': (self.n_samples, len(self.names))}
+
+    def _flush(self, f):
+        n = min(len(vec) for vec in self.vectors)
+        block = np.empty((n, len(self.vectors)), dtype=self.dtype)
+        for j, vec in enumerate(self.vectors):
+            block[:, j] = vec.as_numpy()[:n]
+            vec.resize(0)  # recording continues into the emptied vector
+        f.write(block.tobytes())
+        self.n_samples += n
+
+    def run(self, tstop=None, v_init=None):
+        """Initialize as h.run() does (h.stdinit(), at v_init if given, else h.v_init), run to tstop (default h.tstop)
+        and write the recording; returns the number of samples."""
+        tstop = h.tstop if tstop is None else tstop
+        if v_init is not None:
+            h.v_init = v_init
+        h.stdinit()
+        self.n_samples = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "wb") as f:
+            npy_format.write_array_header_1_0(f, self._header())
+            header_length = f.tell()
+            while h.t < tstop - h.dt / 2:
+                h.continuerun(min(h.t + self.chunk, tstop))
+                self._flush(f)
+            f.seek(0)
+            npy_format.write_array_header_1_0(f, self._header())  # now with the final number of rows
+            if f.tell() != header_length:
+                raise RuntimeError("The .npy header changed length; numpy >= 1.24 is needed for streaming")
+
+        with open(f"{os.path.splitext(self.path)[0]}.json", "w") as f:
+            json.dump({"names": self.names, "sample_dt": self.sample_dt}, f)
+        return self.n_samples
+
+
+def load(path):
+    """Open a StreamRecorder file memory-mapped; returns {name: column} (time under 't')."""
+    data = np.load(path, mmap_mode='r')
+    with open(f"{os.path.splitext(path)[0]}.json") as f:
+        names = json.load(f)["names"]
+    return {name: data[:, j] for j, name in enumerate(names)}
@@ -0,0 +1,173 @@
+""" Content-addressed cache of simulation results.
+
+An entry is keyed on everything that determines a simulation: the model fingerprint (morphology file hashes,
+discretization, a hash of the section and range-variable values of the built cells, the vShift settings and the
+hashes of the .mod files) and the protocol parameters (dt, tstop, celsius, stimulus, seed, ...). Entries are .npz
+files; when the cache grows beyond max_bytes the least recently used entries are removed. """
+
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+from neuron import h
+
+import cells_def
+import discretization
+import morphology_cache
+from cells_def import _mechanism_parameters
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+mod_dir = os.path.join(repo_dir, "mod")
+default_cache_dir = os.path.join(repo_dir, ".result_cache")
+
+_file_hashes = {}
+_spec_values = {}  # (cell_name, morphology hash, discretization) of all cell_spec()s, in order -> [cell_values()]
+
+
+def _hash_file(path):
+    """file_hash, computed once per path and modification time."""
+    key = (path, os.path.getmtime(path))
+    if key not in _file_hashes:
+        _file_hashes[key] = morphology_cache.file_hash(path)
+    return _file_hashes[key]
+
+
+def cell_spec(cell_name, morphology_path, discretization=None):
+    """Stand-in for a Cell in model_fingerprint() when the cells are only built in worker processes (with
+    protocols.build_cells)."""
+    return SimpleNamespace(cell_name=cell_name, morphology_path=morphology_path, discretization=discretization)
+
+
+def cell_values(cell):
+    """Hash of the values that make up a built cell: per section its name, L, Ra and nseg, and per segment diam, cm
+    and the PARAMETERs of every density mechanism (ions included), as they are now (also after changes made after
+    building, e.g. a leak_balance profile)."""
+    digest = hashlib.sha1()
+    for sec in cell.all:
+        values = [sec.name(), sec.L, sec.Ra, sec.nseg]
+        for seg in sec:
+            values += [seg.diam, seg.cm]
+            for mech in seg:
+                mech_name = mech.name()
+                values.append(mech_name)
+                values += [getattr(seg, param) for param, _ in _mechanism_parameters(mech_name)]
+        digest.update(repr(values).encode())
+    return digest.hexdigest()
+
+
+def _cell_values(cells):
+    """cell_values() of each cell. cell_spec()s stand for the whole model a setup builds: they are built together and
+    in this order with protocols.build_cells, once per process, and freed again."""
+    if all(hasattr(cell, "all") for cell in cells):
+        return [cell_values(cell) for cell in cells]
+    key = tuple((cell.cell_name, _hash_file(cell.morphology_path), repr(cell.discretization)) for cell in cells)
+    if key not in _spec_values:
+        from protocols import build_cells  # protocols uses this module
+        built = build_cells({cell.cell_name: cell.morphology_path for cell in cells},
+                            {cell.cell_name: cell.discretization for cell in cells})
+        _spec_values[key] = [cell_values(cell) for cell in built.values()]
+        del built
+    return _spec_values[key]
+
+
+def model_fingerprint(cells):
+    """Everything in the model definition that the results of a simulation of these cells (Cell objects or
+    cell_spec()s) depend on. Under 'cells' only what identifies a cell (name, morphology and discretization);
+    its parameters are in 'values'."""
+    return {
+        "cells": [{
+            "cell_name": cell.cell_name,
+            "morphology": _hash_file(cell.morphology_path),
+            "discretization": repr(discretization.get_policy(cell.discretization).__dict__),
+        } for cell in cells],
+        "values": _cell_values(cells),
+        "vshift": {name: getattr(h, name) for name in cells_def.vshift_names},
+        "mod_files": {name: _hash_file(os.path.join(mod_dir, name))
+                      for name in sorted(os.listdir(mod_dir)) if name.endswith(".mod")},
+    }
+
+
+def _to_builtin(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class ResultCache:
+    def __init__(self, cache_dir=None, max_bytes=1 << 30):
+        self.cache_dir = cache_dir or default_cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, cells, protocol):
+        """Hash of the model fingerprint of `cells` and a dict of protocol parameters."""
+        content = json.dumps({"model": model_fingerprint(cells), "protocol": protocol}, sort_keys=True, default=_to_builtin)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """Stored results for a key as a dict of arrays and numbers (as put()), or None."""
+        path = self._path(key)
+        try:
+            with np.load(path) as npz:
+                results = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # mark as recently used
+        return {name: value.item() if value.ndim == 0 else value for name, value in results.items()}
+
+    def put(self, key, results):
+        """Store a dict of arrays and numbers under a key, then evict old entries if the cache is too large."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **results)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def cached(self, key, run):
+        """Return the stored results for a key, or call run() to compute, store and return them."""
+        results = self.get(key)
+        if results is None:
+            results = run()
+            self.put(key, results)
+        return results
+
+    def cached_batch(self, keys, run_missing):
+        """cached() for a list of keys: run_missing(indices) is called once with the indices of the keys that are not
+        stored (possibly none, so MPI ranks always meet in parallel.run_mpi) and must return their results in that
+        order."""
+        results = [self.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i, result in zip(missing, run_missing(missing)):
+            self.put(keys[i], result)
+            results[i] = result
+        return results
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npz"))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npz"))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz"):
+                os.remove(entry.path)
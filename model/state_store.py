@@ -0,0 +1,135 @@
+""" Store of settled model states (h.SaveState), so that runs can skip the settling period before their stimuli.
+
+Protocols start at v_init and let the cells settle before the first stimulus. StateStore.initialize() replaces the
+initialization of h.run() (h.stdinit()): the first time a model is seen it runs from v_init to t = settle and saves
+the state; later runs restore that state and continue from t = settle.
+
+A state is keyed on the model fingerprint (see result_cache; it includes every range-variable value of the cells, so
+also parameters changed after building such as a leak_balance profile), the run parameters (v_init, dt, celsius,
+settle), the number of sections and segments and the number of instances of every point process and NetCon, since a
+SaveState can only be restored into a model with exactly the same structure, and the parameters and locations of the
+point processes and NetCons that can act before settle. Stimuli that start at or after settle (IClamp del, Gfluct2
+delay, NetStim start, and the NetCons those NetStims drive) are left out, so that e.g. all amplitudes of a current
+step share one state. States are kept in memory and in cache_dir; when cache_dir grows beyond max_bytes the least
+recently used states are removed. """
+
+import hashlib
+import json
+import os
+
+from neuron import h
+
+from cells_def import _mechanism_parameters
+from result_cache import model_fingerprint, repo_dir
+
+default_cache_dir = os.path.join(repo_dir, ".state_cache")
+
+
+def _structure():
+    """Number of sections and segments and of instances of each point process type (and of NetCons) in the model."""
+    mechanism_types = h.MechanismType(1)
+    name = h.ref("")
+    counts = {
+        "sections": sum(1 for _ in h.allsec()),
+        "segments": sum(sec.nseg for sec in h.allsec()),
+        "NetCon": int(h.List("NetCon").count()),
+    }
+    for i in range(int(mechanism_types.count())):
+        mechanism_types.select(i)
+        mechanism_types.selected(name)
+        n = int(h.List(name[0]).count())
+        if n:
+            counts[name[0]] = n
+    return counts
+
+
+# Point process types that do nothing before a time given by one of their PARAMETERs
+onsets = {"IClamp": "del", "Gfluct2": "delay", "NetStim": "start"}
+
+
+def _acts_before(pp, settle):
+    onset = onsets.get(pp.hname().split("[")[0])
+    return onset is None or getattr(pp, onset) < settle
+
+
+def _point_processes(settle):
+    """Location and PARAMETERs of every point process instance that can act before settle (ms), by type, and weight,
+    delay and threshold of every NetCon whose source can."""
+    mechanism_types = h.MechanismType(1)
+    name = h.ref("")
+    parameters = {}
+    for i in range(int(mechanism_types.count())):
+        mechanism_types.select(i)
+        mechanism_types.selected(name)
+        names = [param for param, _ in _mechanism_parameters(name[0])]
+        instances = [[str(pp.get_segment()) if hasattr(pp, "get_segment") else None,
+                      *(getattr(pp, param) for param in names)] for pp in h.List(name[0]) if _acts_before(pp, settle)]
+        if instances:
+            parameters[name[0]] = instances
+    parameters["NetCon"] = [[[nc.weight[j] for j in range(int(nc.wcnt()))], nc.delay, nc.threshold]
+                            for nc in h.List("NetCon") if nc.pre() is None or _acts_before(nc.pre(), settle)]
+    return parameters
+
+
+class StateStore:
+    def __init__(self, cache_dir=None, max_bytes=256 << 20):
+        self.cache_dir = cache_dir or default_cache_dir
+        self.max_bytes = max_bytes
+        self.states = {}  # key: SaveState
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, cells, settle):
+        content = json.dumps({
+            "model": model_fingerprint(cells),
+            "run": {"v_init": h.v_init, "dt": h.dt, "celsius": h.celsius, "settle": settle},
+            "structure": _structure(),
+            "point_processes": _point_processes(settle),
+        }, sort_keys=True)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def initialize(self, cells, settle):
+        """Initialize the model as h.run() does and bring it to t = settle (ms), from a stored state or by running
+        there and storing the state. Call after creating all stimuli and recordings and continue with
+        h.continuerun(h.tstop); recordings start at t = settle. cells: the Cell objects of the model."""
+        h.stdinit()
+        if not settle:
+            return
+        key = self.key(cells, settle)
+        path = os.path.join(self.cache_dir, f"{key}.dat")
+        state = self.states.get(key)
+        if state is None and os.path.exists(path):
+            state = h.SaveState()
+            f = h.File(path)
+            f.ropen()
+            state.fread(f)
+            f.close()
+            os.utime(path)  # mark as recently used
+            self.states[key] = state
+        if state is None:
+            h.continuerun(settle)
+            state = h.SaveState()
+            state.save()
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            f = h.File(tmp_path)
+            f.wopen()
+            state.fwrite(f)  # also closes the file
+            os.replace(tmp_path, path)
+            self.states[key] = state
+            self.evict()
+        else:
+            state.restore()
+        h.frecord_init()  # restart the recordings at the current time
+
+    def evict(self):
+        """Remove least recently used state files until cache_dir fits in max_bytes."""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.cache_dir) if entry.name.endswith(".dat"))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
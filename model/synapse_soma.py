@@ -24,29 +24,13 @@ class Synapse:
         self.netcon.threshold = -20  # AP threshold (mV)
         self.netcon.weight[0] = default_syn_weight
 
-def connect_boutons(chc, pyr):
-    """Connect ChC boutons to the Pyr soma at specific locations.
+def connect_boutons(chc, pyr, cartridge=2, n_boutons=6):
+    """Connect the first n_boutons boutons of a ChC cartridge (an index into chc.cartridges()) to the Pyr soma,
+    the k-th at fraction 0.3 + 0.1 * k along it. Cartridge 2 is chc axon[104] ... axon[114]; also used were
+    cartridges 4 (axon[187] ... axon[195]) and 1 (axon[81] ... axon[89]).
     """
-    bouton_data = [
-        # # Catrdidge 4:
-        (chc.axon[104], 0.3),
-        (chc.axon[106], 0.4),
-        (chc.axon[108], 0.5),
-        (chc.axon[110], 0.6),
-        (chc.axon[112], 0.7),
-        (chc.axon[114], 0.8)
-        # Catride 2:
-        # (chc.axon[187], 0.3),
-        # (chc.axon[189], 0.4),
-        # (chc.axon[191], 0.5),
-        # (chc.axon[193], 0.6),
-        # (chc.axon[195], 0.7),
-        # # Catride 5:
-        # (chc.axon[81], 0.3),
-        # (chc.axon[83], 0.4),
-        # (chc.axon[85], 0.5),
-        # (chc.axon[87], 0.6)
-    ]
+    boutons = chc.cartridges()[cartridge][:n_boutons]
+    bouton_data = [(bouton, round(0.3 + 0.1 * k, 1)) for k, bouton in enumerate(boutons)]
 
     synapses = []
     for bouton, fraction in bouton_data:
@@ -1,74 +1,53 @@
+""" Input resistance of the pyramidal cell and input and transfer impedance (relative to the soma) at the AIS synapse
+sites, the soma and dend[12], for DC and a range of frequencies, with NEURON's Impedance tool (model/impedance.py).
+
+The Impedance tool "freezes" the current state of the cell's properties (such as capacitance, conductance, and axial
+resistance) and computes a linearized system response. The impedance (or input resistance, at 0 Hz) at a location is
+how much the voltage there changes per unit of injected current, under the assumption of linearity. This mimics the
+hoc code:
+
+  objref zz
+  zz = new Impedance()
+  func rn() { local rn
+    init()  // make sure all changes to g, c, ri etc. have taken effect
+    soma zz.loc(0.5)  // sets origin for impedance calculations to middle of soma
+    zz.compute(0)  // DC input R
+    soma { rn = zz.input(0.5) }  // rn is input R at middle of the soma
+    return rn
+  } """
+
+import os
+import sys
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+
+import numpy as np
+import pandas as pd
 from neuron import h
-from neuron.units import mV
+
+import impedance
 from cells_def import Cell
-import tkinter as tk
 
 h.celsius = 34
 h.v_init = -90
 
-
-class SimulationGUI:
-    def __init__(self, master,pyr_cell):
-        self.master = master
-        self.pyr_cell = pyr_cell
-        #self.chc_cell = chc_cell
-        master.title("NEURON Impedance Rin Calculator")
-
-        self.compute_button = tk.Button(master, text="Compute Input Resistance", command=self.compute_input_resistance)
-        self.compute_button.pack()
-
-   
-    """ Specify a location on the cell (e.g., the middle of the soma) where the measurement is made.    
-    The tool “freezes” the current state of the cell’s properties (such as capacitance, conductance, and axial resistance) 
-    and then computes a linearized system response.
-    It then returns the impedance (or input resistance, when at 0 Hz) at that location. This impedance represents how much the voltage will 
-    change per unit of injected current under the assumption of linearity. """
-
-    def compute_input_resistance(self):
-        R_in_pyr = self.compute_rn(self.pyr_cell)
-        #R_in_chc = self.compute_rn(self.chc_cell)
-        
-        print(f"Pyramidal Cell Input Resistance (Impedance method): {R_in_pyr:.2f} MΩ")
-        #print(f"Chandelier Cell Input Resistance (Impedance method): {R_in_chc:.2f} MΩ")
-    
-    def compute_rn(self, cell):
-        """
-        Uses NEURON's Impedance tool to compute the input resistance (Rin) at 0 Hz.
-        This mimics the hoc code:
-        
-          objref zz
-          zz = new Impedance()
-          func rn() { local rn
-            init()  // make sure all changes to g, c, ri etc. have taken effect
-            soma zz.loc(0.5)  // sets origin for impedance calculations to middle of soma
-            zz.compute(0)  // DC input R
-            soma { rn = zz.input(0.5) }  // rn is input R at middle of the soma
-            return rn
-          }
-        
-        """
-        zz = h.Impedance()
-        zz.loc(cell.soma(0.5))  # Set the origin to the middle of the soma
-        h.init()  # Ensure model parameters are updated
-        zz.compute(0)  # Compute impedance at DC (0 Hz)
-        rn = zz.input(0.5)  # Get the input resistance at the middle of the soma
-        return rn
+sites = ["soma", "axon[0](0.3)", "axon[0](0.4)", "axon[0](0.5)", "dend[12](0.5)"]
+frequencies = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]  # Hz
 
 if __name__ == "__main__":
-    # Load your cell models from the specified files
-    pyramidal_cell = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
-    #chandelier_cell = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
-
-    # Add channels as needed
+    morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+    pyramidal_cell = Cell(os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"), "pyr")
     pyramidal_cell.add_sodium_channels()
     pyramidal_cell.add_potassium_channels()
     pyramidal_cell.add_ih_channels()
 
-    # chandelier_cell.add_sodium_channels()
-    # chandelier_cell.add_potassium_channels()
-    # chandelier_cell.add_ih_channels()
+    h.init()  # Ensure model parameters are updated
+    segments = [impedance.segment(pyramidal_cell, location) for location in sites]
+    result = impedance.compute(segments, frequencies, pyramidal_cell.soma(0.5))
 
-    # Create a simple Tkinter GUI
-    root = tk.Tk()
-    gui = SimulationGUI(root, pyramidal_cell)
-    root.mainloop()
\ No newline at end of file
+    print(f"Pyramidal Cell Input Resistance (Impedance method): {result['input'][0, 0]:.2f} MΩ")
+    for name in ("input", "transfer", "ratio"):
+        print(f"\n{name} (rows: frequency in Hz, columns: site; relative to the soma)")
+        print(pd.DataFrame(np.round(result[name], 3), index=frequencies, columns=sites).to_string())
@@ -0,0 +1,87 @@
+""" Benchmark suite: build phases of each cell and a standard run of each protocol of a protocol file, at a fixed dt
+(see model/benchmark.py). Every case runs in a fresh process so that its peak memory is its own. The results are
+printed and appended to benchmark_results.csv, so that runs can be compared over time.
+
+    python tools/benchmark_suite.py                                  # all cases of configs/standard.json
+    python tools/benchmark_suite.py --cases build:chc protocol:noise --dt 0.025 """
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+sys.path.insert(0, os.path.join(repo_dir, "model"))
+
+columns = ["case", "phase", "wall_s", "sim_ms", "sim_ms_per_s", "dt", "nseg", "states", "peak_rss_mb"]
+_marker = "BENCHMARK_ROWS "
+
+
+def run_in_subprocess(case, protocol_file, dt):
+    """Rows of one case, measured by this script in a new interpreter (with the current working directory, where
+    NEURON finds the compiled mechanisms)."""
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), protocol_file, "--dt", str(dt), "--child", case],
+                         capture_output=True, text=True)
+    for line in out.stdout.splitlines():
+        if line.startswith(_marker):
+            return json.loads(line[len(_marker):])
+    sys.exit(f"Benchmark case {case} failed:\n{out.stderr}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _format(value):
+    if value is None:
+        return ""
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cell building and protocol runs.")
+    parser.add_argument("protocol_file", nargs="?", default=os.path.join(repo_dir, "configs", "standard.json"))
+    parser.add_argument("--cases", nargs="+", help="e.g. build:chc protocol:if_curve (default: all)")
+    parser.add_argument("--dt", type=float, default=0.025, help="time step of all protocol runs (ms)")
+    parser.add_argument("--output", default=os.path.join(script_dir, "benchmark_results.csv"))
+    parser.add_argument("--child", help=argparse.SUPPRESS)  # run one case in this process
+    args = parser.parse_args()
+
+    import benchmark
+    import protocol_runner
+
+    config = protocol_runner.load(args.protocol_file)
+    if args.child:
+        print(_marker + json.dumps(benchmark.run_case(args.child, config, args.dt)))
+        sys.exit()
+
+    rows = []
+    for case in args.cases or benchmark.cases(config):
+        print(f"Running {case} ...")
+        rows += run_in_subprocess(case, args.protocol_file, args.dt)
+
+    table = [columns] + [[_format(row.get(name)) for name in columns] for row in rows]
+    widths = [max(len(line[j]) for line in table) for j in range(len(columns))]
+    print()
+    for line in table:
+        print("  ".join(value.rjust(width) for value, width in zip(line, widths)))
+
+    run_info = {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": _git_commit(),
+                "python": sys.version.split()[0], "protocol_file": os.path.basename(args.protocol_file)}
+    new_file = not os.path.exists(args.output)
+    with open(args.output, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=[*run_info, *columns], extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow({**run_info, **row})
+    print(f"\nAppended {len(rows)} rows to '{args.output}'")
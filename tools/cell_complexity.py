@@ -0,0 +1,49 @@
+""" Size of both cells per region and section type (see Cell.complexity()): sections, segments, mechanisms, state
+variables and estimated memory, with each row's share of the cell. Saved to cell_complexity.csv.
+
+    python tools/cell_complexity.py
+    python tools/cell_complexity.py --discretization fast """
+
+import argparse
+import os
+import sys
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+
+import pandas as pd
+
+from cells_def import Cell
+
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+morphologies = {
+    "chc": os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"),
+    "pyr": os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model size per region and section type.")
+    parser.add_argument("--discretization", help="discretization preset (default: the reference mesh)")
+    parser.add_argument("--output", default=os.path.join(script_dir, "cell_complexity.csv"))
+    args = parser.parse_args()
+
+    rows = []
+    for cell_name, path in morphologies.items():
+        cell = Cell(path, cell_name, discretization=args.discretization)
+        cell.add_ih_channels()
+        cell.add_sodium_channels()
+        cell.add_potassium_channels()
+        rows += cell.complexity()
+
+    df = pd.DataFrame(rows)
+    df["mechanisms"] = df["mechanisms"].str.join(" ")
+    df["kB"] = df.pop("bytes") / 1024
+    for column in ("nseg", "states", "kB"):
+        df[f"{column}_share"] = df[column] / df.groupby("cell")[column].transform("sum")
+    print(df.drop(columns="mechanisms").round(3).to_string(index=False))
+    print()
+    print(df.groupby("cell")[["sections", "nseg", "states", "kB"]].sum().round(1).to_string())
+
+    df.to_csv(args.output, index=False)
+    print(f"\nSaved report to '{args.output}'")
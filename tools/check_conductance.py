@@ -1,6 +1,14 @@
-from neuron import h, gui
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+
+from neuron import h
 from neuron.units import ms, mV
 from cells_def import Cell
+import interactive
 import numpy as np 
 from synapse_general import connect_boutons, default_syn_weight
 
@@ -8,8 +16,8 @@ from synapse_general import connect_boutons, default_syn_weight
 h.load_file("stdrun.hoc")
 
 # Create the Chandelier and Pyramidal cells
-chc_cell = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
-pyr_cell = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
+chc_cell = Cell(os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"), "chc")
+pyr_cell = Cell(os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"), "pyr")
 
 # Add channels
 chc_cell.add_ih_channels()
@@ -55,42 +63,49 @@ def update_current():
     h.finitialize(h.v_init)
 
     h.run()
-    graph1.flush()
-    graph2.flush()
-    graph3.flush()
-    graph4.flush()
-
-# GUI Panel
-h.xpanel("Interactive VI Curve")
-h.xlabel("Adjust Current Injection (nA)")
+    for graph in graphs:
+        graph.flush()
+
+# Stimulation amplitudes (nA), adjustable in the GUI panel
 chc_amp = h.ref(0.3)
 pyr_amp = h.ref(0.3)
-h.xvalue("ChC Current", chc_amp, 0.1, update_current)
-h.xvalue("Pyr Current", pyr_amp, 0.1, update_current)
-h.xpanel()
-
-# Graphs for voltage
-graph1 = h.Graph()
-graph1.size(0, h.tstop, -130, 50)
-graph1.addvar("ChC Soma", chc_cell.soma(0.5)._ref_v, 2, 1)
-h.graphList[0].append(graph1)
-
-graph2 = h.Graph()
-graph2.size(0, h.tstop, -130, 50)
-graph2.addvar("Pyr Soma", pyr_cell.soma(0.5)._ref_v, 3, 1)
-graph2.addvar("Pyr AIS", pyr_cell.axon[0](0.5)._ref_v, 4, 1)
-h.graphList[0].append(graph2)
-
-#Graphs for current
-graph3 = h.Graph()
-graph3.size(0, h.tstop, -0.5, 1)
-graph3.addvar("ChC Current", stim_chc._ref_i, 2, 1)
-h.graphList[0].append(graph3)
-
-graph4 = h.Graph()
-graph4.size(0, h.tstop, -0.5, 1)
-graph4.addvar("Pyr Current", stim_pyr._ref_i, 3, 1)
-h.graphList[0].append(graph4)
+
+# Graphs and panels are only built in interactive mode (see model/interactive.py)
+graphs = []
+if interactive.gui():
+    # GUI Panel
+    h.xpanel("Interactive VI Curve")
+    h.xlabel("Adjust Current Injection (nA)")
+    h.xvalue("ChC Current", chc_amp, 0.1, update_current)
+    h.xvalue("Pyr Current", pyr_amp, 0.1, update_current)
+    h.xpanel()
+
+    # Graphs for voltage
+    graph1 = h.Graph()
+    graph1.size(0, h.tstop, -130, 50)
+    graph1.addvar("ChC Soma", chc_cell.soma(0.5)._ref_v, 2, 1)
+    h.graphList[0].append(graph1)
+    graphs.append(graph1)
+
+    graph2 = h.Graph()
+    graph2.size(0, h.tstop, -130, 50)
+    graph2.addvar("Pyr Soma", pyr_cell.soma(0.5)._ref_v, 3, 1)
+    graph2.addvar("Pyr AIS", pyr_cell.axon[0](0.5)._ref_v, 4, 1)
+    h.graphList[0].append(graph2)
+    graphs.append(graph2)
+
+    #Graphs for current
+    graph3 = h.Graph()
+    graph3.size(0, h.tstop, -0.5, 1)
+    graph3.addvar("ChC Current", stim_chc._ref_i, 2, 1)
+    h.graphList[0].append(graph3)
+    graphs.append(graph3)
+
+    graph4 = h.Graph()
+    graph4.size(0, h.tstop, -0.5, 1)
+    graph4.addvar("Pyr Current", stim_pyr._ref_i, 3, 1)
+    h.graphList[0].append(graph4)
+    graphs.append(graph4)
 
 # Initialize and run first simulation
 update_current()
\ No newline at end of file
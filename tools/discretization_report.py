@@ -0,0 +1,42 @@
+""" Compare the discretization presets (see model/discretization.py) for both cells: total number of segments,
+state variables, wall time per step and the voltage error at soma and AIS against the reference mesh. """
+
+import os
+import sys
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+
+from neuron import h
+import pandas as pd
+from cells_def import Cell
+from discretization import discretization_report
+
+morphologies = {
+    "chc": os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"),
+    "pyr": os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"),
+}
+
+h.load_file("stdrun.hoc")
+
+def build_cell(cell_name, policy):
+    cell = Cell(morphologies[cell_name], cell_name, discretization=policy)
+    cell.add_ih_channels()
+    cell.add_sodium_channels()
+    cell.add_potassium_channels()
+    return cell
+
+rows = []
+for cell_name in ["chc", "pyr"]:
+    rows += discretization_report(lambda policy: build_cell(cell_name, policy),
+                                  policies=("reference", "fast", "ultra_fast"), tstop=40, dt=0.025)
+
+df = pd.DataFrame(rows)
+print("\nDiscretization report (errors against the reference mesh):")
+print(df.round(3).to_string(index=False))
+
+filename = os.path.join(script_dir, "discretization_report.csv")
+df.to_csv(filename, index=False)
+print(f"\nSaved report to '{filename}'")
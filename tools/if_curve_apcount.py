@@ -1,28 +1,25 @@
-from neuron import h, gui
-import numpy as np
-import matplotlib.pyplot as plt
-from cells_def import Cell
-
-# 1) Basic Setup
-h.load_file("stdrun.hoc")  # NEURON standard run library
-
-# Create cells
-chc = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
-pyr = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
+import os
+import sys
 
-# Ensure both cells have a soma section
-if not chc.soma or not pyr.soma:
-    raise ValueError("Error: Soma section not found in one of the cells.")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
 
-# Add ion channels
-chc.add_sodium_channels()
-chc.add_potassium_channels()
-chc.add_ih_channels()
-
-pyr.add_sodium_channels()
-pyr.add_potassium_channels()
-pyr.add_ih_channels() 
+from neuron import h
+import numpy as np
+from parallel import run_jobs
+from interactive import pyplot
+from protocols import build_cell_batch, build_cells, step_current, step_current_batch, unstack_results
+from protocol_runner import resolve_path
+from result_cache import ResultCache, cell_spec
 
+# 1) Basic Setup
+morphologies = {  # relative to the repository, as in configs/standard.json
+    "chc": resolve_path("morphologies/L23ChC-j140718b_ar_boutons.asc"),
+    "pyr": resolve_path("morphologies/L23pyr-j150802c_ar.asc"),
+}
+n_workers = os.cpu_count()  # each worker process builds both cells once and then runs (cell, amplitude) jobs
+backend = None  # "serial", "pool" or "mpi"; by default MPI when started with mpiexec -n N, else a process pool
+batch_size = 1  # > 1: simulate this many amplitudes of a cell together in one run (same results, less overhead)
 
 # 2) Define Current Injection Protocol
 
@@ -31,60 +28,77 @@ delay = 100     # ms: start injecting current at 100 ms
 dur = 500       # ms: inject current for 100 ms
 tstop = 700     # ms: total simulation time
 
-h.v_init = -90  # Initial membrane potential (mV)
-h.tstop = tstop
-h.dt = 0.05
-h.celsius = 34
-
-# 3) Run I-F Curve for Both Cells using APCount
-
-firing_rates_chc = []
-firing_rates_pyr = []
-
-for amp in amps:
-    for cell, rates in zip([chc, pyr], [firing_rates_chc, firing_rates_pyr]):
-        # Create IClamp
-        stim = h.IClamp(cell.soma(0.5))
-        stim.delay = delay
-        stim.dur = dur
-        stim.amp = amp
-
-        # Create AP Counter
-        ap_counter = h.APCount(cell.soma(0.5))
-        ap_counter.thresh = -20  # Spike detection threshold
-        
-        # Run the simulation
-        h.finitialize(h.v_init)
-        h.run()
-        
+protocol = {
+    "protocol": "if_curve",
+    "delay": delay,
+    "dur": dur,
+    "tstop": tstop,
+    "dt": 0.05,
+    "celsius": 34,
+    "v_init": -90,  # Initial membrane potential (mV)
+    "thresh": -20,  # Spike detection threshold
+    "settle": 90,   # ms: runs start from a stored settled state at this time (before the step; 0 to disable)
+}
+
+def run_missing(jobs, missing):
+    """Simulate the jobs at these indices, in batches of batch_size amplitudes of one cell."""
+    if batch_size == 1:
+        return run_jobs(build_cells, step_current, [jobs[i] for i in missing], backend, n_workers,
+                        setup_args=(morphologies,))
+    batches = []
+    for cell_name in morphologies:
+        indices = [i for i in missing if jobs[i]["cell"] == cell_name]
+        batches += [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+    batch_jobs = [{**protocol, "cell": jobs[batch[0]]["cell"], "amps": [jobs[i]["amp"] for i in batch]} for batch in batches]
+    batch_results = run_jobs(build_cell_batch, step_current_batch, batch_jobs, backend, n_workers,
+                             setup_args=(morphologies,))
+    results = {i: result for batch, stacked in zip(batches, batch_results)
+               for i, result in zip(batch, unstack_results(stacked))}
+    return [results[i] for i in missing]
+
+if __name__ == "__main__":
+    # 3) Run I-F Curve for Both Cells using APCount, in parallel
+
+    jobs = [{**protocol, "cell": cell_name, "amp": amp} for amp in amps for cell_name in ["chc", "pyr"]]
+
+    # Results of unchanged (cell, amplitude) jobs are loaded from the result cache, the rest is simulated. The key
+    # holds every cell the workers build, in build order, since all of them are in the simulated model.
+    cache = ResultCache()
+    cells = [cell_spec(cell_name, path) for cell_name, path in morphologies.items()]
+    keys = [cache.key(cells, job) for job in jobs]
+    results = cache.cached_batch(keys, lambda missing: run_missing(jobs, missing))
+
+    firing_rates = {"chc": [], "pyr": []}
+    for job, result in zip(jobs, results):
         # Get spike count
-        spike_count = int(ap_counter.n)
+        spike_count = int(result["spike_count"])
         inject_duration_s = dur / 1000.0  # Convert to seconds
         rate_hz = spike_count / inject_duration_s if inject_duration_s > 0 else 0.0
-        
-        rates.append(rate_hz)
-        print(f"Cell {cell} - Amplitude {amp:.2f} nA: {spike_count} spikes, {rate_hz:.1f} Hz")
-        
-        # Remove stimulus
-        stim = None
-
-# 4) Plot the I-F Curves Side by Side
-
-fig, axes = plt.subplots(1, 2, figsize=(12, 5))
-
-# Chandelier Cell
-axes[0].plot(amps, firing_rates_chc, 'o-', lw=2, label="Chandelier Cell")
-axes[0].set_xlabel("Current Injection (nA)", fontsize=12)
-axes[0].set_ylabel("Firing Rate (Hz)", fontsize=12)
-axes[0].set_title("I-F Curve - ChC", fontsize=14)
-axes[0].grid(True)
-
-# Pyramidal Cell
-axes[1].plot(amps, firing_rates_pyr, 'o-', lw=2, label="Pyramidal Cell", color='r')
-axes[1].set_xlabel("Current Injection (nA)", fontsize=12)
-axes[1].set_ylabel("Firing Rate (Hz)", fontsize=12)
-axes[1].set_title("I-F Curve - Pyr", fontsize=14)
-axes[1].grid(True)
-
-plt.tight_layout()
-plt.show()
+
+        firing_rates[job["cell"]].append(rate_hz)
+        print(f"Cell {job['cell']} - Amplitude {job['amp']:.2f} nA: {spike_count} spikes, {rate_hz:.1f} Hz")
+
+    firing_rates_chc = firing_rates["chc"]
+    firing_rates_pyr = firing_rates["pyr"]
+
+    # 4) Plot the I-F Curves Side by Side
+
+    plt = pyplot()
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+
+    # Chandelier Cell
+    axes[0].plot(amps, firing_rates_chc, 'o-', lw=2, label="Chandelier Cell")
+    axes[0].set_xlabel("Current Injection (nA)", fontsize=12)
+    axes[0].set_ylabel("Firing Rate (Hz)", fontsize=12)
+    axes[0].set_title("I-F Curve - ChC", fontsize=14)
+    axes[0].grid(True)
+
+    # Pyramidal Cell
+    axes[1].plot(amps, firing_rates_pyr, 'o-', lw=2, label="Pyramidal Cell", color='r')
+    axes[1].set_xlabel("Current Injection (nA)", fontsize=12)
+    axes[1].set_ylabel("Firing Rate (Hz)", fontsize=12)
+    axes[1].set_title("I-F Curve - Pyr", fontsize=14)
+    axes[1].grid(True)
+
+    plt.tight_layout()
+    plt.show()
@@ -0,0 +1,70 @@
+""" Import time of the model layer in headless mode, measured with `python -X importtime` in a fresh interpreter.
+Fails if a GUI or plotting library was imported, and appends the total and the slowest modules to import_time.csv
+so that changes can be tracked over time. """
+
+import csv
+import os
+import subprocess
+import sys
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+model_dir = os.path.join(repo_dir, "model")
+
+modules = ["cells_def", "protocols", "parallel", "current_search", "features", "recording", "result_cache",
+           "state_store", "synapse_general", "interactive"]
+forbidden = ("neuron.gui", "tkinter", "_tkinter", "matplotlib")  # and their submodules
+n_slowest = 5
+
+
+def measure(modules):
+    """Import the modules in a new interpreter; returns {module: cumulative import time (ms)}, the names imported at
+    top level (not from within another module) and the wall time (ms)."""
+    env = {**os.environ, "HEADLESS": "1",
+           "PYTHONPATH": os.pathsep.join(filter(None, [model_dir, os.environ.get("PYTHONPATH")]))}
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                         cwd=repo_dir, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if out.returncode:
+        sys.exit(out.stderr)
+
+    cumulative = {}
+    top_level = []
+    for line in out.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package", nested imports are indented
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(total_us) / 1000
+        if not name.startswith("  "):
+            top_level.append(name.strip())
+    return cumulative, top_level, wall_ms
+
+
+if __name__ == "__main__":
+    cumulative, top_level, wall_ms = measure(modules)
+
+    loaded = [name for name in cumulative if name.split(".")[0] in forbidden or name.startswith(forbidden)]
+    model_ms = sum(cumulative[name] for name in top_level if name in modules)
+    slowest = sorted(cumulative.items(), key=lambda item: -item[1])[:n_slowest]
+
+    print(f"Model layer import: {model_ms:.0f} ms ({wall_ms:.0f} ms wall time including interpreter start)")
+    for name in modules:
+        # modules already imported by an earlier one only count their own first import
+        print(f"  {name:<16} {cumulative[name]:8.1f} ms" if name in cumulative else f"  {name:<16} (already imported)")
+    print("Slowest imports: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in slowest))
+
+    filename = os.path.join(script_dir, "import_time.csv")
+    new_file = not os.path.exists(filename)
+    with open(filename, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["date", "python", "model_ms", "wall_ms", "gui_modules", "slowest"])
+        writer.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), sys.version.split()[0], f"{model_ms:.1f}",
+                         f"{wall_ms:.1f}", " ".join(loaded), "; ".join(f"{name} {ms:.1f}" for name, ms in slowest)])
+    print(f"Saved to '{filename}'")
+
+    if loaded:
+        sys.exit(f"GUI or plotting modules imported in headless mode: {', '.join(loaded)}")
@@ -1,102 +1,118 @@
-from neuron import h, gui 
-from neuron.units import ms, mV
-from cells_def import Cell
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import os
-
-# Load NEURON's standard run library
-h.load_file("stdrun.hoc")
-
-# Create the pyramidal and chandelier cells
-pyramidal_cell = Cell("C:/Users/user/Documents/NIN/L23pyr-j150802c_ar.asc", "pyr")
-chandelier_cell = Cell("C:/Users/user/Documents/NIN/L23ChC-j140718b_ar_boutons.asc", "chc")
+""" Phase plots (dV/dt against V) of the action potential of both cells at many sites at once: the soma, every
+segment of the hillock and AIS, and the middle of the first sections of the axon beyond the AIS.
 
-# Ensure soma sections exist
-if not pyramidal_cell.soma or not chandelier_cell.soma:
-    raise ValueError("Error: Soma section not found for one or both cells.")
+v and i_cap of all sites are recorded with one recording.BulkRecorder; dV/dt at a site is i_cap / cm of the same
+segment. The phase-plot features of all sites (features.phase_features: threshold, onset rapidity at the kink,
+maximal rise and fall rates) are computed at once, printed and saved to phase_plot.csv; the phase plots of each
+cell are saved to phase_plot_<cell>.svg. """
 
-# Add ion channels
-pyramidal_cell.add_sodium_channels()
-pyramidal_cell.add_potassium_channels()
-pyramidal_cell.add_ih_channels()
-
-chandelier_cell.add_sodium_channels()
-chandelier_cell.add_potassium_channels()
-chandelier_cell.add_ih_channels()
+import os
+import sys
 
-# Inject current into ChC soma
-stim_chc = h.IClamp(chandelier_cell.soma(0.5))
-stim_chc.delay = 50 # ms
-stim_chc.dur = 5     # ms
-stim_chc.amp = 0.3  # nA
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
 
-# Inject current into Pyr soma
-stim_pyr = h.IClamp(pyramidal_cell.soma(0.5))
-stim_pyr.delay = 50 # ms
-stim_pyr.dur = 5     # ms
-stim_pyr.amp = 0.6  # nA
+import numpy as np
+import pandas as pd
+from neuron import h
+
+import features
+from conduction import path_distances
+from interactive import pyplot
+from protocols import build_cells
+from recording import BulkRecorder
+
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+morphologies = {
+    "pyr": os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"),
+    "chc": os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"),
+}
+stim_amps = {"chc": 0.3, "pyr": 0.6}  # nA
+delay = 50  # ms
+dur = 5  # ms
+n_axon = 4  # sections of the axon beyond the AIS
 
-# Simulation parameters
 h.v_init = -70  # Initial membrane potential
-h.tstop = 100   # Simulation time in ms
-h.dt = 0.01     # Time step (important for dV/dt accuracy)
+h.tstop = 100  # Simulation time in ms
+h.dt = 0.01  # Time step (important for dV/dt accuracy); h.stdinit() rounds it to 1 / (steps_per_ms * n) like h.run()
 h.celsius = 34  # Temperature
 
-# Record voltage and dV/dt for both cells
-t = h.Vector().record(h._ref_t)
-
-v_pyr = h.Vector().record(pyramidal_cell.soma(0.5)._ref_v)
-i_cap_pyr = h.Vector().record(pyramidal_cell.soma(0.5)._ref_i_cap)
-
-v_chc = h.Vector().record(chandelier_cell.axon[1](0.5)._ref_v)
-i_cap_chc = h.Vector().record(chandelier_cell.soma(0.5)._ref_i_cap)
-
-# Run the simulation
-h.finitialize(h.v_init)
-h.run()
-
-# Compute dV/dt for both cells using i_cap / cm
-dvdt_pyr = np.array(i_cap_pyr) / pyramidal_cell.soma(0.5).cm
-dvdt_chc = np.array(i_cap_chc) / chandelier_cell.soma(0.5).cm
-
-dvdt_pyr_scaled = dvdt_pyr * 1000
-dvdt_chc_scaled = dvdt_chc * 1000
-
-# Get the directory where this script is located
-script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# --- Chandelier Cell Phase Plot ---
-plt.figure(figsize=(5, 4))
-plt.plot(v_chc, dvdt_chc_scaled, 'r')
-plt.xlabel('Voltage (mV)')
-plt.ylabel('dV/dt (mV/ms)')
-plt.title('Phase Plot - Chandelier')
-plt.tight_layout()
-plt.savefig(os.path.join(script_dir, "phase_plot_chc.svg"), format="svg")
-plt.show()
-
-# # Save Chandelier Cell data to CSV
-# df_chc = pd.DataFrame({
-#     "Voltage_mV": v_chc,
-#     "dVdt_mV_per_ms": dvdt_chc_scaled
-# })
-# df_chc.to_csv(os.path.join(script_dir, "phase_plot_chc.csv"), index=False)
-
-# --- Pyramidal Cell Phase Plot ---
-plt.figure(figsize=(5, 4))
-plt.plot(v_pyr, dvdt_pyr_scaled, 'b')
-plt.xlabel('Voltage (mV)')
-plt.ylabel('dV/dt (mV/ms)')
-plt.title('Phase Plot - Pyramidal')
-plt.tight_layout()
-plt.savefig(os.path.join(script_dir, "phase_plot_pyr.svg"), format="svg")
-plt.show()
-
-# # Save Pyramidal Cell data to CSV
-# df_pyr = pd.DataFrame({
-#     "Voltage_mV": v_pyr,
-#     "dVdt_mV_per_ms": dvdt_pyr_scaled
-# })
-# df_pyr.to_csv(os.path.join(script_dir, "phase_plot_pyr.csv"), index=False)
+def phase_sites(cell):
+    """The soma, every segment of the hillock and AIS, and the middle of the first n_axon sections after the AIS
+    (following the first child). Returns segments and their regions."""
+    segments = [cell.soma(0.5)]
+    regions = ["soma"]
+    ais = cell.regions.get('hillock', []) + cell.regions['ais']
+    for sec in ais:
+        segments += list(sec)
+        regions += [cell.region_of[sec]] * sec.nseg
+    sec = ais[-1]
+    for _ in range(n_axon):
+        if not sec.children():
+            break
+        sec = sec.children()[0]
+        segments.append(sec(0.5))
+        regions.append(cell.region_of[sec])
+    return segments, regions
+
+
+if __name__ == "__main__":
+    cells = build_cells(morphologies)
+
+    stims = []
+    table = []
+    segments = []
+    for cell_name, cell in cells.items():
+        stim = h.IClamp(cell.soma(0.5))
+        stim.delay = delay
+        stim.dur = dur
+        stim.amp = stim_amps[cell_name]
+        stims.append(stim)
+
+        cell_segments, regions = phase_sites(cell)
+        segments += cell_segments
+        table.append(pd.DataFrame({
+            "cell": cell_name,
+            "site": [f"{cell.section_names[seg.sec].split('.')[-1]}({seg.x:.3g})" for seg in cell_segments],
+            "region": regions,
+            "distance": path_distances(cell, cell_segments),  # µm from the middle of the soma
+        }))
+    table = pd.concat(table, ignore_index=True)
+
+    # v and i_cap of every site, gathered together after each time step
+    t_vec = h.Vector().record(h._ref_t)
+    recorder = BulkRecorder([seg._ref_v for seg in segments] + [seg._ref_i_cap for seg in segments])
+    h.stdinit()  # initialize as h.run() does, so the rates are taken at the same time step
+    h.continuerun(h.tstop)
+    recorder.remove()
+
+    t = t_vec.as_numpy()
+    v, i_cap = np.split(recorder.as_array(), 2)
+    cm = np.array([seg.cm for seg in segments])
+    dvdt = i_cap / cm[:, None] * 1000  # mA/cm² ÷ µF/cm² = 10³ V/s = mV/ms, so the factor is 1000
+
+    for name, values in features.phase_features(t, v, dvdt).items():
+        table[name] = values
+    table["threshold_time"] -= delay
+    print(table.round(3).to_string(index=False))
+    filename = os.path.join(script_dir, "phase_plot.csv")
+    table.to_csv(filename, index=False)
+    print(f"\nSaved to '{filename}'")
+
+    # --- Phase plots, one line per site ---
+    plt = pyplot()  # Agg backend in headless mode
+    for cell_name in cells:
+        rows = np.flatnonzero(table["cell"] == cell_name)
+        plt.figure(figsize=(6, 5))
+        for k, i in enumerate(rows):
+            plt.plot(v[i], dvdt[i], color=plt.cm.viridis(k / max(1, len(rows) - 1)), linewidth=1,
+                     label=f"{table['site'][i]} ({table['distance'][i]:.0f} µm)")
+        plt.xlabel('Voltage (mV)')
+        plt.ylabel('dV/dt (mV/ms)')
+        plt.title(f'Phase Plot - {cell_name}')
+        plt.legend(fontsize=6)
+        plt.tight_layout()
+        plt.savefig(os.path.join(script_dir, f"phase_plot_{cell_name}.svg"), format="svg")
+        plt.show()
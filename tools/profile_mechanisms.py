@@ -0,0 +1,64 @@
+""" Profile a standard model by mechanism and region (see model/profiling.py): both cells with all channels, the ChC
+boutons on the pyramidal AIS and Gfluct2 noise at the pyramidal soma, as in the noise protocol of a protocol file.
+Prints the breakdown and saves it to mechanism_profile.json.
+
+    python tools/profile_mechanisms.py
+    python tools/profile_mechanisms.py configs/standard.json --protocol noise --tstop 20 --repeats 3 """
+
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(script_dir)
+sys.path.insert(0, os.path.join(repo_dir, "model"))
+
+from neuron import h
+
+import profiling
+import protocol_runner
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wall time per mechanism and region, by ablation.")
+    parser.add_argument("protocol_file", nargs="?", default=os.path.join(repo_dir, "configs", "standard.json"))
+    parser.add_argument("--protocol", default="noise", help="noise protocol whose network and noise are profiled")
+    parser.add_argument("--tstop", type=float, default=20, help="simulated ms per timed run")
+    parser.add_argument("--dt", type=float, default=0.025)
+    parser.add_argument("--repeats", type=int, default=3, help="paired runs per configuration (the fastest are used)")
+    parser.add_argument("--output", default=os.path.join(script_dir, "mechanism_profile.json"))
+    args = parser.parse_args()
+
+    config = protocol_runner.load(args.protocol_file)
+    spec = next(spec for spec in config["protocols"] if spec.get("name", spec["type"]) == args.protocol)
+    protocol = protocol_runner.Protocol(spec, config["morphologies"], config.get("defaults", {}))
+    job = protocol.jobs()[0]
+
+    def build():
+        model = protocol.setup(*protocol.setup_args())
+        gfluct = h.Gfluct2(model["cells"]["pyr"].soma(0.5))
+        for name, value in job["noise"].items():
+            setattr(gfluct, name, value)
+        gfluct.delay = 0  # Gfluct2 does no work before its delay
+        gfluct.new_seed(job["seed"])
+        model["gfluct"] = gfluct
+        return model
+
+    report = profiling.profile(build, args.tstop, args.dt, job["v_init"], job["celsius"], args.repeats)
+
+    print(f"\nFull model: {report['baseline_ms_per_ms']:.2f} ms wall time per simulated ms "
+          f"({report['nseg']} segments, dt = {args.dt} ms); it varied by "
+          f"{report['baseline_spread_ms_per_ms']:.2f} ms/ms during the profile\n")
+    print(f"{'mechanism':<16}{'kind':<15}{'instances':>10}{'ms/ms':>10}{'share':>8}")
+    for row in report["mechanisms"]:
+        print(f"{row['mechanism']:<16}{row['kind']:<15}{row['instances']:>10}{row['ms_per_ms']:>10.3f}"
+              f"{row['share']:>8.1%}")
+    print(f"\n{'cell':<6}{'region':<10}{'nseg':>7}{'channels':>10}{'cable':>10}{'share':>8}")
+    for row in report["regions"]:
+        print(f"{row['cell']:<6}{row['region']:<10}{row['nseg']:>7}{row['channels_ms_per_ms']:>10.3f}"
+              f"{row['cable_ms_per_ms']:>10.3f}{row['share']:>8.1%}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nSaved to '{args.output}'")
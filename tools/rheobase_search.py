@@ -0,0 +1,48 @@
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+
+from neuron import h
+from current_search import find_current
+from parallel import run_jobs
+from protocol_runner import resolve_path
+from protocols import build_cells
+
+# Finds the rheobase and the step current for a target firing rate of each cell by bisection, instead of scanning
+# an amplitude grid. Each (cell, target) search runs as a job, in parallel.
+
+# 1) Basic Setup
+morphologies = {  # relative to the repository, as in configs/standard.json
+    "chc": resolve_path("morphologies/L23ChC-j140718b_ar_boutons.asc"),
+    "pyr": resolve_path("morphologies/L23pyr-j150802c_ar.asc"),
+}
+n_workers = os.cpu_count()
+backend = None  # "serial", "pool" or "mpi"; by default MPI when started with mpiexec -n N, else a process pool
+
+# 2) Current step and search settings (the step of experiments/steadycurrent.py)
+protocol = {
+    "delay": 50,        # ms
+    "dur": 150,         # ms
+    "tail": 20,         # ms: spikes are counted until this long after the step
+    "tstop": 300,       # ms
+    "dt": 0.05,
+    "celsius": 34,
+    "v_init": -90,      # Initial membrane potential (mV)
+    "thresh": -20,      # Spike detection threshold
+    "settle": 40,       # ms: runs start from a stored settled state at this time (before the step)
+    "low": 0.0,         # nA: search interval
+    "high": 2.0,
+    "precision": 0.005, # nA
+}
+targets = [None, 50]  # None: rheobase; otherwise firing rate in Hz during the step
+
+if __name__ == "__main__":
+    jobs = [{**protocol, "cell": cell_name, "target_hz": target} for cell_name in morphologies for target in targets]
+    results = run_jobs(build_cells, find_current, jobs, backend, n_workers, setup_args=(morphologies,))
+
+    for job, result in zip(jobs, results):
+        target = "rheobase" if job["target_hz"] is None else f"{job['target_hz']} Hz ({result['spikes']} spikes)"
+        print(f"Cell {job['cell']} - {target}: {result['amp']:.3f} nA "
+              f"(+/- {job['precision']} nA, {result['runs']} runs)")
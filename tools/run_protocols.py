@@ -0,0 +1,42 @@
+""" Run the protocols of a protocol file (JSON or YAML, see model/protocol_runner.py) headless and in batch, and
+write the results as JSON, one file per protocol.
+
+    python tools/run_protocols.py configs/standard.json
+    python tools/run_protocols.py configs/standard.json --only if_curve noise --backend pool --workers 8
+    mpiexec -n 16 python tools/run_protocols.py configs/standard.json --backend mpi
+
+Results go to results/<protocol file name>/ unless --output is given. """
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+
+import protocol_runner
+from parallel import backends
+from result_cache import repo_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run declarative simulation protocols.")
+    parser.add_argument("protocol_file", help="JSON or YAML protocol file")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these protocols")
+    parser.add_argument("--backend", choices=backends, help="default: mpi under mpiexec, else pool")
+    parser.add_argument("--workers", type=int, help="number of worker processes of the pool (default: all cores)")
+    parser.add_argument("--output", help="output folder (default: results/<protocol file name>)")
+    parser.add_argument("--no-cache", action="store_true", help="simulate even if results are in the result cache")
+    args = parser.parse_args()
+
+    config = protocol_runner.load(args.protocol_file)
+    start = time.perf_counter()
+    records = protocol_runner.run(config, args.only, args.backend, args.workers, use_cache=not args.no_cache)
+    elapsed = time.perf_counter() - start
+
+    name = os.path.splitext(os.path.basename(args.protocol_file))[0]
+    output_dir = args.output or os.path.join(repo_dir, "results", name)
+    for path in protocol_runner.save(records, output_dir, config):
+        print(f"Saved '{path}'")
+    print(f"{sum(len(protocol_records) for protocol_records in records.values())} jobs in {elapsed:.1f} s")
@@ -1,74 +1,57 @@
-from neuron import h
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-
-from cells_def import Cell
-# Load NEURON's standard run library    
-h.load_file("stdrun.hoc")
-# Create the Pyramidal cell
-pyr_cell = Cell("C:/Users/user/Documents/NIN_internship/L23pyr-j150802c_ar.asc", "pyr")
-
-# 1. Define the hyperpolarizing current clamp at the soma
-stim = h.IClamp(pyr_cell.soma(0.5))
-stim.delay = 100  # ms
-stim.dur = 200    # ms
-stim.amp = -0.05  # nA (small hyperpolarizing step)
-
-# 2. Set up recordings
-t_vec = h.Vector().record(h._ref_t)
-v_vec = h.Vector().record(pyr_cell.soma(0.5)._ref_v)
-
-# 3. Run the simulation
-h.tstop = 400
-h.v_init = -90  # adjust as needed
-h.finitialize(h.v_init)
-h.run()
-
-# 4. Convert recordings
-t = np.array(t_vec)
-v = np.array(v_vec)
-
-# 5. Plot the voltage trace
-plt.figure(figsize=(8,4))
-plt.plot(t, v)
-plt.xlabel('Time (ms)')
-plt.ylabel('Membrane Potential (mV)')
-plt.title('Voltage Response to Hyperpolarizing Step')
-plt.show()
-
-# 6. Fit the exponential decay after the current is turned off
-offset_time = stim.delay + stim.dur  # 100 + 200 = 300 ms
-idx_offset = np.where(t >= offset_time)[0][0]
-
-# Fit from offset_time to offset_time + 50 ms (adjust if needed)
-fit_window = (t >= offset_time) & (t <= offset_time + 50)
-t_fit = t[fit_window] - offset_time  # reset time to 0
-v_fit = v[fit_window]
-
-# 7. Define single exponential decay function
-def exp_decay(t, V0, tau, Vinf):
-    return Vinf + (V0 - Vinf) * np.exp(-t / tau)
-
-# 8. Estimate initial parameters
-V0_guess = v_fit[0]
-Vinf_guess = v_fit[-1]
-tau_guess = 20  # ms (initial guess)
-
-# 9. Fit the data
-popt, _ = curve_fit(exp_decay, t_fit, v_fit, p0=[V0_guess, tau_guess, Vinf_guess])
-V0_fit, tau_fit, Vinf_fit = popt
-
-print(f"Estimated tau: {tau_fit:.2f} ms")
-
-# 10. Plot the fit
-t_fine = np.linspace(0, 50, 500)
-v_fitted = exp_decay(t_fine, V0_fit, tau_fit, Vinf_fit)
-
-plt.figure(figsize=(8,4))
-plt.plot(t_fit, v_fit, 'b.', label='Data')
-plt.plot(t_fine, v_fitted, 'r-', label=f'Fit: tau={tau_fit:.2f} ms')
-plt.xlabel('Time since current off (ms)')
-plt.ylabel('Membrane Potential (mV)')
-plt.legend()
-plt.show()
+""" Membrane time constant of both cells from the voltage decay after hyperpolarizing current steps at the soma, for
+several amplitudes in one run (protocols.membrane_tau_batch: one copy of a cell per amplitude).
+
+By default the cells are passive (no ih, sodium or potassium channels) at NEURON's default temperature, as this
+script has always measured them; passive = False measures the active membrane at 34 °C instead, as the
+membrane_tau protocols do.
+
+Every decay is fitted with a single exponential and, where it fits significantly better, with the sum of n_exp
+exponentials (features.peel_exponentials). The fits of all traces are done at once; scipy is only used to refine
+traces that peeling fits poorly. The table is printed and saved to tau_calc.csv. """
+
+import os
+import sys
+
+os.environ.setdefault("HEADLESS", "1")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(script_dir), "model"))
+
+import pandas as pd
+
+from protocols import build_cell_batch, membrane_tau_batch
+
+morphology_dir = os.path.join(os.path.dirname(script_dir), "morphologies")
+morphologies = {
+    "chc": os.path.join(morphology_dir, "L23ChC-j140718b_ar_boutons.asc"),
+    "pyr": os.path.join(morphology_dir, "L23pyr-j150802c_ar.asc"),
+}
+
+passive = True
+
+job = {
+    "amps": [-0.02, -0.05, -0.1],  # nA (small hyperpolarizing steps)
+    "delay": 100,  # ms
+    "dur": 200,  # ms
+    "tstop": 400,  # ms
+    "fit_window": 50,  # ms after the current is turned off
+    "n_exp": 2,
+    "dt": 0.025,
+    "celsius": 6.3 if passive else 34,
+    "v_init": -90,
+}
+
+if __name__ == "__main__":
+    result = membrane_tau_batch(build_cell_batch(morphologies, channels=not passive), job)
+
+    table = pd.DataFrame({name: result[name] for name in
+                          ("cell", "amp", "v_rest", "rin_step", "tau", "Vinf", "r2", "n_components", "r2_peeled")})
+    for k in range(job["n_exp"]):
+        table[f"tau_{k + 1}"] = result["taus"][:, k]
+        table[f"amplitude_{k + 1}"] = result["amplitudes"][:, k]
+    print(table.round(3).to_string(index=False))
+    print("\nMean single-exponential tau per cell (ms):")
+    print(table.groupby("cell")["tau"].agg(["mean", "std"]).round(2).to_string())
+
+    filename = os.path.join(script_dir, "tau_calc.csv")
+    table.to_csv(filename, index=False)
+    print(f"\nSaved to '{filename}'")